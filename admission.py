@@ -0,0 +1,98 @@
+import asyncio
+
+from ratelimit import KeyedRateLimiter
+
+
+class _Burst:
+    __slots__ = ("messages", "started", "timer")
+
+    def __init__(self, message, started):
+        self.messages = [message]
+        self.started = started
+        self.timer = None
+
+
+class AdmissionController:
+    """Decides whether, and when, chat messages turn into a model request.
+
+    Messages from the same user in the same channel arriving within
+    `debounce` seconds of each other are merged into one burst (never held
+    longer than `max_burst_wait`). A burst is then admitted only if the
+    user, channel and guild token buckets all have room and the generation
+    queue isn't saturated; otherwise it is dropped. Admitted bursts are
+    passed to `dispatch(messages, deadline)`, where `deadline` is the
+    event loop time after which the request is too stale to be worth
+    generating.
+    """
+
+    def __init__(self, dispatch, debounce=1.0, max_burst_wait=4.0, max_age=30.0,
+                 user_limit=(6, 60), channel_limit=(20, 60), guild_limit=(60, 60),
+                 is_saturated=lambda: False):
+        self.dispatch = dispatch
+        self.debounce = debounce
+        self.max_burst_wait = max_burst_wait
+        self.max_age = max_age
+        self.user_limiter = KeyedRateLimiter(*user_limit)
+        self.channel_limiter = KeyedRateLimiter(*channel_limit)
+        self.guild_limiter = KeyedRateLimiter(*guild_limit)
+        self.is_saturated = is_saturated
+        self._bursts = {}
+        self._tasks = set()
+        self.stats = {"received": 0, "debounced": 0, "admitted": 0, "rate_limited": 0, "shed": 0}
+
+    @property
+    def pending(self):
+        return len(self._bursts)
+
+    def submit(self, message):
+        """Queue a message; returns immediately"""
+        self.stats["received"] += 1
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        key = (message.author.id, message.channel.id)
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst(message, now)
+        else:
+            burst.messages.append(message)
+            burst.timer.cancel()
+            self.stats["debounced"] += 1
+        delay = min(self.debounce, max(0.0, burst.started + self.max_burst_wait - now))
+        burst.timer = loop.call_later(delay, self._fire, key)
+
+    def _fire(self, key):
+        burst = self._bursts.pop(key, None)
+        if burst is None:
+            return
+        task = asyncio.ensure_future(self._admit(burst))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _allowed(self, message):
+        guild = getattr(message, "guild", None)
+        return (self.user_limiter.try_acquire(message.author.id)
+                and self.channel_limiter.try_acquire(message.channel.id)
+                and (guild is None or self.guild_limiter.try_acquire(guild.id)))
+
+    async def _admit(self, burst):
+        message = burst.messages[-1]
+        if not self._allowed(message):
+            self.stats["rate_limited"] += 1
+            print(f"Rate limited burst of {len(burst.messages)} message(s) from {message.author.id}")
+            return
+        if self.is_saturated():
+            self.stats["shed"] += 1
+            print(f"Shedding burst from {message.author.id}: generation queue is full")
+            return
+        self.stats["admitted"] += 1
+        deadline = burst.started + self.max_age
+        await self.dispatch(burst.messages, deadline)
+
+    async def drain(self):
+        """Fire every pending burst now and wait for all dispatches to finish"""
+        for key, burst in list(self._bursts.items()):
+            burst.timer.cancel()
+            self._fire(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
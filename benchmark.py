@@ -0,0 +1,680 @@
+"""Offline benchmarks for Nikki's hot paths.
+
+Usage:
+    python benchmark.py scheduler --reminders 100000
+    python benchmark.py intents --members 100000
+    python benchmark.py pipeline --users 1,100,1000,10000 --messages 5000 --rate 200
+    python benchmark.py triggers --messages 200000
+    python benchmark.py listings --items 50 --polls 200 [--fixture saved_page.html]
+    python benchmark.py cluster --workers 3
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from datetime import datetime, timedelta
+
+from scheduler import ReminderScheduler
+from triggers import TriggerMatcher
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+# ==== REMINDER SCHEDULER ====
+def bench_scheduler(args):
+    """Linear 30s scan over ISO strings (old check_reminders) vs the heap scheduler"""
+    rng = random.Random(args.seed)
+    base = datetime.utcnow()
+    reminders = {
+        f"reminder_{i}": {'next_reminder': (base + timedelta(seconds=rng.uniform(0, args.horizon))).isoformat()}
+        for i in range(args.reminders)
+    }
+
+    def linear_tick(now):
+        due = []
+        for reminder_id, reminder in reminders.items():
+            if now >= datetime.fromisoformat(reminder['next_reminder']):
+                due.append(reminder_id)
+        return due
+
+    scheduler = ReminderScheduler()
+
+    def build():
+        for reminder_id, reminder in reminders.items():
+            scheduler.schedule(reminder_id, datetime.fromisoformat(reminder['next_reminder']).timestamp())
+
+    _, build_time = _timed(build)
+
+    ticks = args.horizon // 30
+    linear_total = 0.0
+    heap_total = 0.0
+    fired = 0
+    for tick in range(1, ticks + 1):
+        now = base + timedelta(seconds=tick * 30)
+        _, elapsed = _timed(linear_tick, now)
+        linear_total += elapsed
+        due, elapsed = _timed(scheduler.pop_due, now.timestamp())
+        heap_total += elapsed
+        fired += len(due)
+
+    rearm_ids = rng.sample(list(reminders), min(10000, len(reminders)))
+
+    def rearm():
+        for reminder_id in rearm_ids:
+            scheduler.schedule(reminder_id, base.timestamp() + rng.uniform(0, args.horizon))
+
+    _, rearm_time = _timed(rearm)
+
+    print(f"reminders={args.reminders} ticks={ticks} fired={fired}")
+    print(f"linear scan : {linear_total / ticks * 1000:9.3f} ms/tick  (worst-case lateness 30s)")
+    print(f"heap        : {heap_total / ticks * 1000:9.3f} ms/tick  (fires at due time)")
+    print(f"heap build  : {build_time * 1000:9.3f} ms")
+    print(f"heap re-arm : {rearm_time / len(rearm_ids) * 1e6:9.3f} us/op")
+
+
+# ==== INTENTS / CACHE PROFILES ====
+def _fixture_guild(members, with_members, with_presences):
+    """GUILD_CREATE-shaped payload for a large guild (members only when chunked/privileged)"""
+    member_data = [
+        {
+            "user": {"id": str(10**17 + i), "username": f"user{i}", "discriminator": "0",
+                     "global_name": f"User {i}", "avatar": None},
+            "roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "nick": None,
+        }
+        for i in range(members if with_members else 0)
+    ]
+    presences = [
+        {"user": {"id": m["user"]["id"]}, "status": "online", "activities": [], "client_status": {"desktop": "online"}}
+        for m in member_data[::3]
+    ] if with_presences else []
+    return {
+        "id": "1", "name": "Fixture", "owner_id": "1", "member_count": members, "features": [],
+        "emojis": [], "stickers": [], "large": True, "members": member_data, "presences": presences,
+        "roles": [{"id": "1", "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(100 + c), "type": 0, "name": f"channel-{c}", "position": c,
+                      "permission_overwrites": []} for c in range(50)],
+    }
+
+
+def _profile_child(args):
+    """Measure one profile in a fresh process so RSS numbers don't bleed between profiles"""
+    import discord
+    from discord.state import ConnectionState
+    from client_profiles import client_options
+
+    options = client_options(args.profile)
+    intents = options["intents"]
+    chunked = options.get("chunk_guilds_at_startup", True) and intents.members
+    payloads = [_fixture_guild(args.members, chunked, intents.presences) for _ in range(args.guilds)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    state = ConnectionState(dispatch=lambda *a, **k: None, handlers={}, hooks={}, http=None, **options)
+    guilds = [discord.Guild(data=payload, state=state) for payload in payloads]
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    cached_members = sum(len(guild.members) for guild in guilds)
+    print(json.dumps({
+        "profile": args.profile, "seconds": elapsed, "cache_mb": current / 2**20, "peak_mb": peak / 2**20,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "cached_members": cached_members,
+    }))
+
+
+def bench_intents(args):
+    """Guild load time and memory for each intents/cache profile on a simulated large guild"""
+    if args.profile:
+        _profile_child(args)
+        return
+    from client_profiles import PROFILES
+
+    print(f"guilds={args.guilds} members/guild={args.members}")
+    for profile in PROFILES:
+        out = subprocess.run(
+            [sys.executable, __file__, "intents", "--profile", profile,
+             "--members", str(args.members), "--guilds", str(args.guilds)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{r['profile']:8}: load {r['seconds'] * 1000:9.1f} ms  cache {r['cache_mb']:8.1f} MB  "
+              f"max RSS {r['max_rss_mb']:8.1f} MB  cached members {r['cached_members']}")
+
+
+# ==== MESSAGE PIPELINE ====
+class _FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.display_name = name
+        self.bot = bot
+
+    def mentioned_in(self, message):
+        return False
+
+
+class _FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+    def typing(self):
+        return _Typing()
+
+
+class _FakeMessage:
+    """Just enough of discord.Message for on_message and handle_conversation"""
+
+    def __init__(self, message_id, author, channel, guild, content, replies):
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.content = content
+        self.created = time.perf_counter()
+        self._replies = replies
+
+    async def reply(self, text):
+        self._replies.append(time.perf_counter() - self.created)
+        return self
+
+    async def edit(self, content=None):
+        return self
+
+
+class _FakeResponse:
+    def __init__(self, replies, created):
+        self._replies = replies
+        self._created = created
+
+    async def send_message(self, content=None, **kwargs):
+        self._replies.append(time.perf_counter() - self._created)
+
+
+class _FakeInteraction:
+    def __init__(self, user, replies):
+        self.user = user
+        self.response = _FakeResponse(replies, time.perf_counter())
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _drive_pipeline(main, args, users):
+    rng = random.Random(args.seed)
+    main.bot._connection.user = _FakeUser(1, "Nikki", bot=True)
+    people = [_FakeUser(1000 + i, f"user{i}") for i in range(users)]
+    channels = [_FakeChannel(2000 + i) for i in range(args.channels)]
+    guild = _FakeGuild(3000)
+    replies, interaction_replies = [], []
+    background = [asyncio.create_task(main.memory_writer.run()), asyncio.create_task(main.loop_lag.run())]
+    writes_before = main.store.writes
+
+    start = time.perf_counter()
+    for i in range(args.messages):
+        author = people[rng.randrange(users)]
+        channel = channels[author.id % len(channels)]
+        if rng.random() < args.interactions:
+            await main.memory_slash.callback(_FakeInteraction(author, interaction_replies))
+        else:
+            content = f"hey nikki, message {i} about {rng.choice(['music', 'games', 'movies', 'crypto', 'food'])}"
+            await main.on_message(_FakeMessage(i, author, channel, guild, content, replies))
+        delay = start + (i + 1) / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    offered = time.perf_counter() - start
+
+    while main.admission.pending:
+        await asyncio.sleep(0.05)
+    await main.admission.drain()
+    elapsed = time.perf_counter() - start
+    await main.memory_writer.flush()
+    for task in background:
+        task.cancel()
+
+    lag = main.loop_lag.histogram
+    return {
+        "users": users,
+        "messages": args.messages,
+        "offered_per_sec": args.messages / offered,
+        "replies": len(replies),
+        "replies_per_sec": len(replies) / elapsed,
+        "p50_ms": _percentile(replies, 0.5) * 1000,
+        "p99_ms": _percentile(replies, 0.99) * 1000,
+        "interaction_p99_ms": _percentile(interaction_replies, 0.99) * 1000,
+        "loop_lag_mean_ms": (lag.sum / lag.count if lag.count else 0.0) * 1000,
+        "loop_lag_max_ms": main.loop_lag.max * 1000,
+        "store_writes": main.store.writes - writes_before,
+        "records_flushed": main.memory_writer.records_flushed,
+        "db_kb": sum(os.path.getsize(main.DB_FILE + suffix) for suffix in ("", "-wal")
+                     if os.path.exists(main.DB_FILE + suffix)) / 1024,
+        "admission": main.admission.stats,
+    }
+
+
+def _pipeline_child(args):
+    """Import the real bot against a fake model and a scratch database, then drive it"""
+    workdir = tempfile.mkdtemp(prefix="nikki-bench-")
+    os.environ.update({
+        "FAKE_MODEL_LATENCY": str(args.latency),
+        "FAKE_MODEL_JITTER": str(args.jitter),
+        "DB_FILE": os.path.join(workdir, "bench.db"),
+        "ADMISSION_DEBOUNCE": str(args.debounce),
+    })
+    if args.no_limits:
+        os.environ.update({"USER_RATE_LIMIT": "1000000", "CHANNEL_RATE_LIMIT": "1000000", "GUILD_RATE_LIMIT": "1000000"})
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import main
+    result = asyncio.run(_drive_pipeline(main, args, int(args.profile)))
+    print(json.dumps(result))
+
+
+def bench_pipeline(args):
+    """on_message -> admission -> handle_conversation -> reply throughput against a fake Gemini"""
+    if args.profile:
+        _pipeline_child(args)
+        return
+    print(f"messages={args.messages} rate={args.rate}/s latency={args.latency}s±{args.jitter}s "
+          f"channels={args.channels} limits={'off' if args.no_limits else 'on'}")
+    for users in args.users.split(","):
+        command = [sys.executable, __file__, "pipeline", "--profile", users]
+        for name in ("messages", "rate", "latency", "jitter", "channels", "interactions", "debounce", "seed"):
+            command += [f"--{name}", str(getattr(args, name))]
+        if args.no_limits:
+            command.append("--no-limits")
+        out = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"users={r['users']:>6}: {r['replies_per_sec']:7.1f} replies/s ({r['replies']} replies)  "
+              f"p50 {r['p50_ms']:7.0f} ms  p99 {r['p99_ms']:7.0f} ms  "
+              f"loop lag mean {r['loop_lag_mean_ms']:5.1f} ms max {r['loop_lag_max_ms']:6.1f} ms  "
+              f"writes {r['store_writes']} ({r['records_flushed']} records, {r['db_kb']:.0f} KB)")
+        print(f"{'':14}admission {r['admission']}")
+
+
+# ==== TRIGGER MATCHING ====
+WORDS = ("gm", "anyone", "seen", "the", "new", "patch", "lol", "wen", "moon", "pump", "raid", "tonight", "who",
+         "wants", "to", "play", "ranked", "brb", "coffee", "this", "chart", "looks", "bullish", "ngl", "ok")
+
+
+class _TrafficMessage:
+    __slots__ = ("content", "channel_id", "guild", "mentions", "mention_everyone")
+
+    def __init__(self, content, channel_id, mentions):
+        self.content = content
+        self.channel_id = channel_id
+        self.guild = 1
+        self.mentions = mentions
+        self.mention_everyone = False
+
+
+def _mentioned_in(bot_id, message):
+    # What discord.py's ClientUser.mentioned_in does
+    if message.mention_everyone:
+        return True
+    return any(user == bot_id for user in message.mentions)
+
+
+def bench_triggers(args):
+    """Old substring scan over lowercased content vs the precompiled trigger regex"""
+    rng = random.Random(args.seed)
+    names = ["nikki", "nikhita"]
+    bot_id, main_channel = 1, 999
+    messages = []
+    for _ in range(args.messages):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, args.max_words))]
+        if rng.random() < args.hit_rate:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(["Nikki", "nikki's", "NIKHITA"]))
+        elif rng.random() < args.near_miss:
+            # Shares the prefix but isn't a name, so it has to go through the regex
+            words.insert(rng.randrange(len(words) + 1), rng.choice(["nikkei", "Nikon", "nikkita"]))
+        mentions = [bot_id] if rng.random() < args.hit_rate / 4 else []
+        messages.append(_TrafficMessage(" ".join(words), rng.randrange(100), mentions))
+
+    def old(message):
+        return (message.channel_id == main_channel
+                or _mentioned_in(bot_id, message)
+                or message.guild is None
+                or any(name in message.content.lower() for name in names))
+
+    matcher = TriggerMatcher(names)
+
+    def new(message):
+        return (message.channel_id == main_channel
+                or matcher.matches(message.content)
+                or message.guild is None
+                or _mentioned_in(bot_id, message))
+
+    old_hits, old_time = _timed(lambda: sum(1 for message in messages if old(message)))
+    new_hits, new_time = _timed(lambda: sum(1 for message in messages if new(message)))
+    print(f"messages={args.messages} hit_rate={args.hit_rate} near_miss={args.near_miss}")
+    print(f"substring scan : {old_time / args.messages * 1e9:8.0f} ns/msg  ({old_hits} triggered)")
+    print(f"compiled regex : {new_time / args.messages * 1e9:8.0f} ns/msg  ({new_hits} triggered, whole words only)")
+
+
+# ==== LISTINGS WATCHER ====
+def _fixture_page(count, offset=0):
+    """An announcements page in the KuCoin layout parse_announcements reads"""
+    items = "".join(
+        f'<li><a href="/announcement/fixture-{i}"><h3>Listing {i} (FIX{i})</h3>'
+        f"<p>Trading: FIX{i}/USDT</p><p>2024-01-{i % 28 + 1:02d}</p></a></li>"
+        for i in range(offset + count, offset, -1)
+    )
+    return f"<html><body><ul class='list'>{items}</ul></body></html>"
+
+
+async def _serve_fixtures(pages):
+    """Local stand-in for the announcements site: /etag/<page> answers conditional requests, /plain/<page> doesn't"""
+    from aiohttp import web
+
+    async def handler(request):
+        body = pages[request.match_info["page"]]().encode()
+        if request.match_info["mode"] == "plain":
+            return web.Response(body=body, content_type="text/html")
+        etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=body, content_type="text/html", headers={"ETag": etag})
+
+    app = web.Application()
+    app.add_routes([web.get("/{mode}/{page}", handler)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+async def _bench_listings(args):
+    import aiohttp
+    from listings import Source, WatcherEngine
+
+    fixture_html = open(args.fixture, encoding="utf-8").read() if args.fixture else None
+    state = {"offset": 0}
+    pages = {
+        "generated": lambda: _fixture_page(args.items, state["offset"]),
+        "fixture": lambda: fixture_html,
+    }
+    runner, base = await _serve_fixtures(pages)
+    seen = set()
+    failures = {"left": 0}
+
+    async def on_items(source, items):
+        if failures["left"]:
+            failures["left"] -= 1
+            raise RuntimeError("simulated failure while queueing items")
+        new = [item for item in items if item["id"] not in seen]
+        seen.update(item["id"] for item in new)
+        return len(new)
+
+    async with aiohttp.ClientSession() as session:
+        engine = WatcherEngine([], lambda: session, on_items)
+        page = "fixture" if fixture_html else "generated"
+        for mode in ("etag", "plain"):
+            seen.clear()
+            source = Source(mode, f"{base}/{mode}/{page}", [], base_url="https://www.kucoin.com")
+            _, first = await _timed_async(engine.poll(source))
+            start = time.perf_counter()
+            for _ in range(args.polls):
+                await engine.poll(source)
+            repeat = (time.perf_counter() - start) / args.polls
+            print(f"{mode:5} first poll {first * 1000:7.2f} ms ({len(seen)} items parsed), "
+                  f"unchanged poll {repeat * 1000:6.2f} ms")
+
+        # A changed page whose items fail to queue must be handled again on the next poll, not skipped
+        seen.clear()
+        source = Source("retry", f"{base}/etag/generated", [], base_url="https://www.kucoin.com")
+        await engine.poll(source)
+        state["offset"] += 1
+        failures["left"] = 1
+        try:
+            await engine.poll(source)
+        except RuntimeError:
+            pass
+        status, new_items = await engine.poll(source)
+        print(f"after a failed on_items the next poll got status {status} and {new_items} new item(s)"
+              f" ({'retried' if new_items else 'LOST'})")
+    await runner.cleanup()
+
+
+async def _timed_async(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - start
+
+
+def bench_listings(args):
+    """Watcher poll cost against a local stand-in for the announcements page"""
+    asyncio.run(_bench_listings(args))
+
+
+# ==== CLUSTER ====
+async def _cluster_worker(args):
+    """One worker: the scheduler lease plus per-user ownership and forwarding, as main.py wires them"""
+    import aiohttp
+    from aiohttp import web
+    from routing import ClusterRouter
+    from storage import Store, Lease, Ownership
+
+    worker_id = f"worker-{args.worker}"
+    store = Store(args.db, synced=("reminders",))
+    lease = Lease(store, "scheduler", worker_id, ttl=args.lease_ttl)
+    owners = Ownership(store, "memory", worker_id, ttl=args.owner_ttl)
+    session = aiohttp.ClientSession()
+    router = ClusterRouter(store, worker_id, f"http://127.0.0.1:{args.port}", args.secret, lambda: session)
+
+    async def handle(data):
+        owners.claim(data["user_id"])
+        return {"handled_by": worker_id}
+
+    async def chat(request):
+        # What dispatch_burst does with an admitted message
+        user_id = request.query["user"]
+        owner = owners.claim(user_id)
+        if owner is not None:
+            reply = await router.forward(owner, {"kind": "chat", "user_id": user_id})
+            if reply is not None:
+                return web.json_response(reply)
+        return web.json_response({"handled_by": worker_id})
+
+    async def status(request):
+        return web.json_response({"worker": worker_id, "leader": lease.held})
+
+    app = web.Application()
+    app.add_routes([router.route(handle), web.get("/chat", chat), web.get("/status", status)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    router.register()
+    await lease.run()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.1)
+    return None
+
+
+def bench_cluster(args):
+    """Several worker processes on one store: lease handover and forwarding chats to the user's owner"""
+    if args.worker is not None:
+        asyncio.run(_cluster_worker(args))
+        return
+    tmp = tempfile.mkdtemp(prefix="nikki-cluster-")
+    db = os.path.join(tmp, "cluster.db")
+    ports = [_free_port() for _ in range(args.workers)]
+    procs = {}
+    for worker, port in enumerate(ports):
+        procs[worker] = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), "cluster", "--worker", str(worker), "--db", db,
+            "--port", str(port), "--secret", "benchmark", "--lease-ttl", str(args.lease_ttl),
+            "--owner-ttl", str(args.owner_ttl),
+        ])
+
+    def get(worker, path):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{ports[worker]}{path}", timeout=5) as response:
+                return json.loads(response.read())
+        except OSError:
+            return None
+
+    def alive():
+        return [worker for worker, proc in procs.items() if proc.poll() is None]
+
+    def leaders():
+        statuses = [get(worker, "/status") for worker in alive()]
+        return [status["worker"] for status in statuses if status and status["leader"]]
+
+    results = []
+
+    def check(name, ok, detail):
+        print(f"{'PASS' if ok else 'FAIL'} {name}: {detail}")
+        results.append(ok)
+
+    def kill(worker_id):
+        worker = int(worker_id.rsplit("-", 1)[1])
+        procs[worker].send_signal(signal.SIGKILL)
+        procs[worker].wait()
+
+    try:
+        started = _wait_for(lambda: all(get(worker, "/status") for worker in procs), 30)
+        check("workers up", bool(started), f"{args.workers} workers sharing {db}")
+        if not started:
+            return
+
+        found = _wait_for(lambda: leaders() or None, args.lease_ttl * 3)
+        samples = [leaders() for _ in range(10) if not time.sleep(args.lease_ttl / 5)]
+        check("one leader", bool(found) and all(len(sample) == 1 for sample in samples),
+              f"{found} held the lease in all {len(samples)} samples" if found else "nobody took the lease")
+
+        handled = [get(worker, "/chat?user=u1")["handled_by"] for worker in alive()]
+        owner = handled[0]
+        check("forwarded to owner", set(handled) == {owner},
+              f"u1 chatting on {len(handled)} workers was answered by {handled}")
+
+        leader = leaders()[0]
+        kill(leader)
+        start = time.monotonic()
+        new = _wait_for(lambda: [worker for worker in leaders() if worker != leader] or None, args.lease_ttl * 4)
+        check("lease handover", bool(new) and len(leaders()) == 1,
+              f"{leader} killed, {new} took over after {time.monotonic() - start:.1f}s" if new else f"{leader} killed, no new leader")
+
+        if owner != leader and owner in [f"worker-{worker}" for worker in alive()]:
+            kill(owner)
+        survivors = alive()
+        if len(survivors) < 2:
+            print("(need at least 2 surviving workers to check ownership handover; use --workers 3 or more)")
+        else:
+            time.sleep(args.owner_ttl + 0.5)
+            handled = [get(worker, "/chat?user=u1")["handled_by"] for worker in survivors]
+            check("ownership handover", len(set(handled)) == 1 and handled[0] != owner,
+                  f"after {owner} died u1 was answered by {handled}")
+    finally:
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in procs.values():
+            proc.wait()
+    if not all(results):
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    p = sub.add_parser("scheduler", help="reminder scheduler vs linear scan")
+    p.add_argument("--reminders", type=int, default=100000)
+    p.add_argument("--horizon", type=int, default=3600, help="spread due times over this many seconds")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=bench_scheduler)
+
+    p = sub.add_parser("intents", help="startup time / memory per intents profile")
+    p.add_argument("--members", type=int, default=100000, help="members per simulated guild")
+    p.add_argument("--guilds", type=int, default=1)
+    p.add_argument("--profile", help=argparse.SUPPRESS)
+    p.set_defaults(func=bench_intents)
+
+    p = sub.add_parser("pipeline", help="chat pipeline throughput / latency against a fake model")
+    p.add_argument("--users", default="1,100,1000,10000", help="comma separated simulated user counts")
+    p.add_argument("--messages", type=int, default=5000)
+    p.add_argument("--rate", type=float, default=200, help="offered messages per second")
+    p.add_argument("--latency", type=float, default=0.5, help="fake model latency (seconds)")
+    p.add_argument("--jitter", type=float, default=0.2)
+    p.add_argument("--channels", type=int, default=50)
+    p.add_argument("--interactions", type=float, default=0.05, help="fraction of events that are /memory")
+    p.add_argument("--debounce", type=float, default=1.0)
+    p.add_argument("--no-limits", action="store_true", help="disable per user/channel/guild rate limits")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--profile", help=argparse.SUPPRESS)
+    p.set_defaults(func=bench_pipeline)
+
+    p = sub.add_parser("triggers", help="on_message trigger check over synthetic guild traffic")
+    p.add_argument("--messages", type=int, default=200000)
+    p.add_argument("--hit-rate", type=float, default=0.02, help="fraction of messages naming Nikki")
+    p.add_argument("--near-miss", type=float, default=0.01, help="fraction with a name-like word (nikkei, nikon...)")
+    p.add_argument("--max-words", type=int, default=30)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=bench_triggers)
+
+    p = sub.add_parser("listings", help="listings polls (full, 304, unchanged body) against a local fixture server")
+    p.add_argument("--items", type=int, default=50, help="listings on the generated fixture page")
+    p.add_argument("--polls", type=int, default=200)
+    p.add_argument("--fixture", help="serve this saved announcements page instead of a generated one")
+    p.set_defaults(func=bench_listings)
+
+    p = sub.add_parser("cluster", help="lease handover and owner forwarding across worker processes (exits 1 on failure)")
+    p.add_argument("--workers", type=int, default=3)
+    p.add_argument("--lease-ttl", type=float, default=1.5)
+    p.add_argument("--owner-ttl", type=float, default=2.0)
+    p.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    p.add_argument("--db", help=argparse.SUPPRESS)
+    p.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    p.add_argument("--secret", help=argparse.SUPPRESS)
+    p.set_defaults(func=bench_cluster)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import discord
+
+PROFILES = ("minimal", "full")
+
+
+def client_options(profile="minimal", message_cache_size=100):
+    """Keyword arguments for the bot constructor for an intents/cache profile.
+
+    "minimal" subscribes only to what Nikki uses (guilds for the channel
+    cache, guild and DM messages, and message content), caches no members,
+    skips member chunking at startup and keeps a small message cache.
+    "full" is Intents.all() with discord.py's default caching.
+    """
+    if profile == "full":
+        return {"intents": discord.Intents.all()}
+    if profile != "minimal":
+        raise ValueError(f"Unknown intents profile {profile!r}, expected one of {PROFILES}")
+
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+        "max_messages": message_cache_size or None,
+    }
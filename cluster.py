@@ -0,0 +1,96 @@
+"""Run Nikki as several worker processes on one machine, each owning a slice of the shards.
+
+Usage:
+    python cluster.py --workers 4 --shards 8
+
+Every worker runs main.py with SHARD_COUNT / SHARD_IDS set, its own PORT
+(PORT, PORT+1, ...) and a WORKER_ID. State is shared through the SQLite
+store, and reminders plus the listings watcher only run in whichever worker
+holds the scheduler lease. Each user's conversation memory is owned by one
+worker at a time; the others forward that user's chats to it over the
+workers' web servers, authenticated with a shared CLUSTER_SECRET. Crashed workers are restarted with backoff;
+SIGINT/SIGTERM stops them all.
+"""
+import argparse
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import time
+
+RESTART_BACKOFF_MAX = 60
+
+
+def shard_slices(shard_count, workers):
+    return [[shard for shard in range(shard_count) if shard % workers == worker] for worker in range(workers)]
+
+
+def start_worker(worker, shard_ids, shard_count, base_port, secret):
+    env = dict(os.environ)
+    env.update({
+        "CLUSTER_SECRET": secret,
+        "SHARD_COUNT": str(shard_count),
+        "SHARD_IDS": ",".join(str(shard) for shard in shard_ids),
+        "WORKER_ID": f"worker-{worker}",
+        "PORT": str(base_port + worker),
+    })
+    print(f"Starting worker {worker} with shards {shard_ids}")
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")], env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--shards", type=int, default=int(os.environ.get("SHARD_COUNT", 0)) or None,
+                        help="total shard count (defaults to SHARD_COUNT, else one per worker)")
+    args = parser.parse_args()
+
+    shard_count = args.shards or args.workers
+    if shard_count < args.workers:
+        parser.error("need at least one shard per worker")
+    base_port = int(os.environ.get("PORT", 10000))
+    slices = shard_slices(shard_count, args.workers)
+    secret = os.environ.get("CLUSTER_SECRET") or secrets.token_hex(16)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    procs = {worker: start_worker(worker, slices[worker], shard_count, base_port, secret) for worker in range(args.workers)}
+    backoff = {worker: 1 for worker in procs}
+    restart_at = {}
+
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for worker, proc in procs.items():
+            if worker in restart_at:
+                if now >= restart_at[worker]:
+                    del restart_at[worker]
+                    procs[worker] = start_worker(worker, slices[worker], shard_count, base_port, secret)
+                continue
+            code = proc.poll()
+            if code is not None:
+                print(f"Worker {worker} exited with {code}; restarting in {backoff[worker]}s")
+                restart_at[worker] = now + backoff[worker]
+                backoff[worker] = min(backoff[worker] * 2, RESTART_BACKOFF_MAX)
+
+    print("Stopping workers...")
+    for proc in procs.values():
+        if proc.poll() is None:
+            proc.terminate()
+    for proc in procs.values():
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import random
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class GenerationBusy(Exception):
+    """Raised when the generation queue is full and a request has to be shed"""
+
+
+class GenerationExpired(Exception):
+    """Raised when a request waited in the queue past its deadline and was dropped"""
+
+
+class GenerationPool:
+    """Runs blocking model calls off the event loop with bounded concurrency.
+
+    At most `max_workers` generations run at once overall, at most
+    `per_channel` at once for any single channel, and no more than
+    `max_queue` requests may be waiting or running before new ones are
+    rejected with GenerationBusy. Requests given a `deadline` (event loop
+    time) that has passed by the time a worker frees up are dropped with
+    GenerationExpired instead of being generated for nobody.
+    """
+
+    def __init__(self, max_workers=8, per_channel=2, max_queue=64):
+        self.max_workers = max_workers
+        self.per_channel = per_channel
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self._channel_slots = {}
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+
+    @property
+    def saturated(self):
+        return self.pending >= self.max_queue
+
+    async def run(self, key, func, *args, deadline=None):
+        """Run func(*args) in the worker pool, limited per `key` (usually a channel id)"""
+        if self.pending >= self.max_queue:
+            self.rejected += 1
+            raise GenerationBusy(f"{self.pending} generations already queued")
+
+        self.pending += 1
+        slot, users = self._channel_slots.get(key, (None, 0))
+        if slot is None:
+            slot = asyncio.Semaphore(self.per_channel)
+        self._channel_slots[key] = (slot, users + 1)
+        try:
+            async with slot:
+                loop = asyncio.get_running_loop()
+                if deadline is not None and loop.time() > deadline:
+                    self.expired += 1
+                    raise GenerationExpired("request went stale while queued")
+                self.running += 1
+                try:
+                    return await loop.run_in_executor(self._executor, func, *args)
+                finally:
+                    self.running -= 1
+                    self.completed += 1
+        finally:
+            self.pending -= 1
+            # Drop idle per-channel semaphores so the dict doesn't grow forever
+            slot, users = self._channel_slots[key]
+            if users <= 1:
+                del self._channel_slots[key]
+            else:
+                self._channel_slots[key] = (slot, users - 1)
+
+    async def stream(self, key, func, *args, deadline=None):
+        """Run a blocking generator func(*args) in the pool, yielding its items as they arrive"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            for item in func(*args):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        task = asyncio.ensure_future(self.run(key, produce, deadline=deadline))
+        # Queued after every item the producer pushed, and also fires if run() is rejected
+        task.add_done_callback(lambda _: queue.put_nowait(done))
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            yield item
+        await task
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+# ==== RESPONSE CACHE ====
+# Openers that mean the same thing whoever says them and whatever came before.
+# Replies like "thanks" or "lol" depend on the conversation, so they're not here.
+SMALL_TALK = frozenset("""
+hi hii hiii hey heyy heya hiya hello helo yo howdy gm gn good morning afternoon evening night
+how are r you u doing
+""".split())
+CACHE_WORD = re.compile(r"[a-z']+")
+# Everything a small-talk message may contain: its words, spaces and plain punctuation
+SMALL_TALK_CHARS = re.compile(r"[a-z'\s.,!?~-]*")
+
+
+class ResponseCache:
+    """LRU + TTL cache of model replies to small talk, shared by every user.
+
+    Ordinary prompts carry the user's name and history, so the same words
+    from two people (or from one person twice) never produce the same
+    prompt. Only short messages made entirely of `small_talk` words ("hey
+    nikki", "gm", "good morning!") get a `shared_key`; those are answered from a
+    prompt without the user's context, so the reply can be reused. Concurrent
+    requests for the same key share one upstream call: the first caller
+    generates, the rest await its result.
+    """
+
+    def __init__(self, max_entries=1024, ttl=120, max_words=5, small_talk=SMALL_TALK):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_words = max_words
+        self.small_talk = small_talk
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.uncacheable = 0
+
+    def shared_key(self, message, ignore=()):
+        """Cache key for small talk, or None if the reply should depend on who's asking.
+
+        Words in `ignore` (the bot's names) are dropped first, so "hi nikki"
+        and "hi" share a reply.
+        """
+        lowered = message.lower()
+        if not SMALL_TALK_CHARS.fullmatch(lowered):
+            return None  # digits, symbols, emoji or non-Latin text: not something to answer generically
+        words = [word for word in CACHE_WORD.findall(lowered) if word not in ignore]
+        if not words or len(words) > self.max_words or not all(word in self.small_talk for word in words):
+            return None
+        return hashlib.sha1(" ".join(words).encode()).hexdigest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, text = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def put(self, key, text):
+        self._entries[key] = (time.monotonic() + self.ttl, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_generate(self, key, generate):
+        """Return the cached reply for `key`, or await `generate()` (a coroutine function) once.
+
+        A None key (not small talk) always generates.
+        """
+        if key is None:
+            self.uncacheable += 1
+            return await generate()
+        text = self.get(key)
+        if text is not None:
+            self.hits += 1
+            return text
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            text = await generate()
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            self.put(key, text)
+            future.set_result(text)
+            return text
+        finally:
+            del self._inflight[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "uncacheable": self.uncacheable,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+# ==== FAKE MODEL (local throughput testing) ====
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Stand-in for genai.GenerativeModel that sleeps instead of calling Gemini"""
+
+    def __init__(self, latency=1.0, jitter=0.0, reply="haha yeah totally, tell me more!"):
+        self.latency = latency
+        self.jitter = jitter
+        self.reply = reply
+        self.calls = 0
+
+    def _delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def generate_content(self, context, stream=False):
+        self.calls += 1
+        if stream:
+            return self._stream()
+        time.sleep(self._delay())
+        return _FakeResponse(self.reply)
+
+    def _stream(self):
+        words = self.reply.split(" ")
+        delay = self._delay() / len(words)
+        for i, word in enumerate(words):
+            time.sleep(delay)
+            yield _FakeResponse(word if i == 0 else " " + word)
+
+    async def generate_content_async(self, context):
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        return _FakeResponse(self.reply)
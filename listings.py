@@ -0,0 +1,501 @@
+import asyncio
+import base64
+import contextlib
+import email.utils
+import functools
+import hashlib
+import json
+import math
+import os
+import random
+import time
+import zlib
+from collections import OrderedDict
+
+import aiohttp
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Only build a tree for the <li> entries of the listing, not the whole page
+LISTING_ITEMS = SoupStrainer("li")
+
+
+class AnnouncementFetcher:
+    """Polls one announcements page with conditional requests.
+
+    Sends If-None-Match / If-Modified-Since from the previous response and
+    hashes the body, so `fetch` only hands back HTML when the page really
+    changed and the caller can skip parsing otherwise. A changed page's
+    validators are only remembered once the caller `commit`s them after
+    handling its items, so a failure there means the page is fetched and
+    handled again on the next poll instead of being skipped as unchanged.
+    """
+
+    def __init__(self, url, timeout=15):
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.retry_after = None
+        self.not_modified = 0
+        self.unchanged = 0
+        self.changed = 0
+
+    async def fetch(self, session):
+        """Return (status, html, validators).
+
+        html is None when the page is unchanged or the request failed;
+        otherwise pass `validators` to `commit` once the page is handled.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        self.retry_after = None
+        async with session.get(self.url, headers=headers, timeout=self.timeout) as resp:
+            if resp.status == 304:
+                self.not_modified += 1
+                return resp.status, None, None
+            if resp.status != 200:
+                self.retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                return resp.status, None, None
+            body = await resp.read()
+            validators = (resp.headers.get("ETag"), resp.headers.get("Last-Modified"), hashlib.sha1(body).hexdigest())
+
+        if validators[2] == self.content_hash:
+            # Same content we already handled, so the new validators are safe to keep right away
+            self.commit(validators)
+            self.unchanged += 1
+            return 200, None, None
+        self.changed += 1
+        return 200, body.decode("utf-8", errors="replace"), validators
+
+    def commit(self, validators):
+        self.etag, self.last_modified, self.content_hash = validators
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def parse_announcements(html, base_url="https://www.kucoin.com"):
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=LISTING_ITEMS)
+    items = []
+    for li in soup.find_all("li"):
+        a = li.find("a", href=True)
+        if not a:
+            continue
+        url = base_url + a["href"]
+        title_tag = a.find("h3")
+        title = title_tag.get_text(strip=True) if title_tag else "No Title"
+        ps = a.find_all("p")
+        trading_info = ps[0].get_text(strip=True) if len(ps) > 0 else ""
+        date_info = ps[1].get_text(strip=True) if len(ps) > 1 else ""
+        unique_id = a["href"]  # Use the URL path as a unique identifier
+        items.append({
+            "id": unique_id,
+            "title": title,
+            "trading_info": trading_info,
+            "date_info": date_info,
+            "url": url
+        })
+    return items
+
+
+# Page layouts the watcher knows how to read, by name (used in source configs)
+PARSERS = {
+    "kucoin": parse_announcements,
+}
+
+
+# ==== WATCHER ENGINE ====
+class Source:
+    """A listings page to watch and the channels its new items are posted to.
+
+    The poll interval adapts between `min_interval` and `max_interval`: it
+    drops back to `min_interval` as soon as something new shows up (listings
+    tend to come in bursts) and stretches by `slowdown` after every quiet
+    poll. Failures back off exponentially up to `max_backoff`, and a
+    Retry-After from a 429/503 is always honoured.
+    """
+
+    def __init__(self, name, url, channels, parser="kucoin", base_url=None,
+                 min_interval=60, max_interval=600, slowdown=1.5, max_backoff=3600, timeout=15):
+        self.name = name
+        self.channels = list(channels)
+        self.parse = PARSERS[parser] if base_url is None else functools.partial(PARSERS[parser], base_url=base_url)
+        self.fetcher = AnnouncementFetcher(url, timeout)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.slowdown = slowdown
+        self.max_backoff = max_backoff
+        self.interval = min_interval
+        self.errors = 0
+        self.polls = 0
+        self.new_items = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
+
+    def next_delay(self, status, new_items=0, retry_after=None):
+        """Update the schedule after a poll and return the seconds until the next one"""
+        self.polls += 1
+        if status in (200, 304):
+            self.errors = 0
+            self.new_items += new_items
+            if new_items:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval, self.interval * self.slowdown)
+            delay = self.interval
+        else:
+            self.errors += 1
+            delay = min(self.max_backoff, self.interval * 2 ** self.errors)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        # Jitter so sources (and workers) don't fall into lockstep
+        return delay * random.uniform(0.9, 1.1)
+
+
+class WatcherEngine:
+    """Polls every Source concurrently over one shared HTTP session.
+
+    Each source runs its own loop on its own adaptive schedule, with at most
+    `max_concurrent` requests in flight. Changed pages are parsed in a worker
+    thread and handed to `on_items(source, items)`, which posts whatever is
+    new and returns how many items that was. `before_poll()` is awaited
+    before every poll so the caller can hold polling back (e.g. until this
+    process holds the scheduler lease).
+    """
+
+    def __init__(self, sources, get_session, on_items, before_poll=None, max_concurrent=4, span=None):
+        self.sources = sources
+        self.get_session = get_session
+        self.on_items = on_items
+        self.before_poll = before_poll
+        self.span = span or (lambda name, **fields: contextlib.nullcontext())
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    async def run(self):
+        await asyncio.gather(*(self._watch(source) for source in self.sources))
+
+    async def poll(self, source):
+        """Poll one source once; returns (status, new item count). status is None on errors"""
+        async with self._slots:
+            with self.span("listings_fetch", source=source.name):
+                status, html, validators = await source.fetcher.fetch(self.get_session())
+        if html is None:
+            return status, 0
+        with self.span("listings_parse", source=source.name):
+            items = await asyncio.to_thread(source.parse, html)
+        new_items = await self.on_items(source, items)
+        source.fetcher.commit(validators)
+        return status, new_items
+
+    async def _watch(self, source):
+        while True:
+            if self.before_poll:
+                await self.before_poll()
+            status, new_items = None, 0
+            try:
+                status, new_items = await self.poll(source)
+                if status not in (200, 304):
+                    print(f"Failed to fetch {source.name}: {status}")
+            except Exception as e:
+                print(f"Error polling {source.name}: {e}")
+            await asyncio.sleep(source.next_delay(status, new_items, source.fetcher.retry_after))
+
+
+# ==== SEEN ANNOUNCEMENTS ====
+class BloomFilter:
+    """Fixed-size Bloom filter; answers "maybe seen" for ids evicted from the recent window"""
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def dumps(self):
+        return base64.b64encode(zlib.compress(bytes(self.bits))).decode()
+
+    @classmethod
+    def loads(cls, data, capacity=100000, error_rate=0.001):
+        bloom = cls(capacity, error_rate)
+        bits = bytearray(zlib.decompress(base64.b64decode(data)))
+        if len(bits) == len(bloom.bits):
+            bloom.bits = bits
+        return bloom
+
+
+class SeenStore:
+    """Bounded set of announcement ids already posted.
+
+    Keeps the most recent `max_items` ids (and none older than `max_age`
+    seconds) in an insertion-ordered dict mirrored row by row in the Store.
+    Ids pushed out of that window go into a Bloom filter, so very old
+    listings are still recognised without keeping them around. Memory and
+    disk use stay constant no matter how long the watcher runs.
+    """
+
+    def __init__(self, store, namespace="seen", max_items=5000, max_age=90 * 86400):
+        self.store = store
+        self.namespace = namespace
+        self.max_items = max_items
+        self.max_age = max_age
+        self._recent = OrderedDict(sorted(store.load(namespace).items(), key=lambda item: item[1]))
+        bloom_data = store.get_meta(f"{namespace}_bloom")
+        self.bloom = BloomFilter.loads(bloom_data) if bloom_data else BloomFilter()
+        self._evict()
+
+    def __contains__(self, item_id):
+        return item_id in self._recent or item_id in self.bloom
+
+    def __len__(self):
+        return len(self._recent)
+
+    def add(self, item_id):
+        if item_id in self._recent:
+            return
+        self._recent[item_id] = int(time.time())
+        self.store.upsert(self.namespace, item_id, self._recent[item_id])
+        self._evict()
+
+    def migrate_json(self, file):
+        """Import the old unbounded kucoin_seen.json list once"""
+        if not os.path.exists(file):
+            return
+        try:
+            with open(file, "r") as f:
+                old_ids = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not migrate {file}: {e}")
+            return
+        now = int(time.time())
+        for item_id in old_ids:
+            if item_id not in self._recent:
+                self._recent[item_id] = now
+        self.store.upsert_many(self.namespace, {item_id: now for item_id in old_ids})
+        self._evict()
+        os.replace(file, file + ".migrated")
+        print(f"Migrated {len(old_ids)} seen id(s) from {file}")
+
+    def _evict(self):
+        cutoff = time.time() - self.max_age
+        evicted = []
+        while self._recent:
+            item_id, seen_at = next(iter(self._recent.items()))
+            if len(self._recent) <= self.max_items and seen_at >= cutoff:
+                break
+            self._recent.popitem(last=False)
+            self.bloom.add(item_id)
+            evicted.append(item_id)
+        if evicted:
+            self.store.delete_many(self.namespace, evicted)
+            self.store.set_meta(f"{self.namespace}_bloom", self.bloom.dumps())
+
+
+# ==== OUTBOUND QUEUE ====
+class AnnouncementQueue:
+    """Durable outbox that delivers each new listing to each channel once.
+
+    Every (item, channel) delivery is written to the Store before anything
+    is sent, so a crash or restart resumes the burst instead of dropping or
+    repeating it. Each channel is drained by its own worker, packing up to
+    `batch_size` items (Discord's 10 embeds, within `max_chars` of text)
+    into one `send(channel_id, items)` call after `wait_for_slot`. A batch
+    is acknowledged in one write as soon as it's sent; once an item has
+    reached all its channels it's deleted from the outbox and handed to
+    `on_delivered(source, item_id)` to be marked seen.
+
+    Failed sends retry with exponential backoff; errors `is_permanent`
+    recognises (missing channel, no permission) and batches still failing
+    after `max_attempts` are dropped for that channel only.
+    """
+
+    def __init__(self, store, send, on_delivered, wait_for_slot=None, before_send=None, is_permanent=None,
+                 namespace="outbox", batch_size=10, max_chars=5500, base_delay=2, max_delay=300, max_attempts=8,
+                 span=None):
+        self.store = store
+        self.send = send
+        self.on_delivered = on_delivered
+        self.wait_for_slot = wait_for_slot
+        self.before_send = before_send
+        self.is_permanent = is_permanent or (lambda error: False)
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self.max_chars = max_chars
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.span = span or (lambda name, **fields: contextlib.nullcontext())
+        self._records = {}  # outbox key -> {"source", "item", "channels": [channel ids still to send to]}
+        self._channels = {}  # channel id -> OrderedDict of outbox keys waiting for that channel
+        self._workers = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.sent = 0
+        self.messages = 0
+        self.retries = 0
+        self.dropped = 0
+        self._load()
+
+    @property
+    def pending(self):
+        return sum(len(keys) for keys in self._channels.values())
+
+    def __contains__(self, key):
+        return key in self._records
+
+    @staticmethod
+    def key(source, item_id):
+        return f"{source}:{item_id}"
+
+    def _load(self):
+        self._records = self.store.load(self.namespace)
+        self._channels = {}
+        for key, record in self._records.items():
+            for channel_id in record["channels"]:
+                self._channels.setdefault(channel_id, OrderedDict())[key] = None
+
+    def reload(self):
+        """Re-read the outbox from the Store and resume sending (another worker may have sent some of it)"""
+        self._load()
+        self._start_workers()
+
+    def enqueue(self, source, items, channels):
+        """Persist new items for delivery to `channels`, then start sending"""
+        added = {}
+        for item in items:
+            key = self.key(source, item["id"])
+            if key in self._records:
+                continue
+            added[key] = self._records[key] = {"source": source, "item": item, "channels": list(channels)}
+        if not added:
+            return 0
+        self.store.upsert_many(self.namespace, added)
+        for key in added:
+            for channel_id in channels:
+                self._channels.setdefault(channel_id, OrderedDict())[key] = None
+        self._start_workers()
+        return len(added)
+
+    async def join(self):
+        """Wait until everything queued so far has been delivered or dropped"""
+        await self._idle.wait()
+
+    def _start_workers(self):
+        for channel_id, keys in self._channels.items():
+            if keys and channel_id not in self._workers:
+                self._idle.clear()
+                self._workers[channel_id] = asyncio.get_running_loop().create_task(self._drain(channel_id))
+
+    def _next_batch(self, channel_id):
+        # The channel (or some of its items) may be gone if a reload ran while this worker waited
+        batch, chars = [], 0
+        for key in self._channels.get(channel_id, ()):
+            record = self._records.get(key)
+            if record is None:
+                continue
+            item = record["item"]
+            size = sum(len(str(value)) for value in item.values())
+            if batch and (len(batch) == self.batch_size or chars + size > self.max_chars):
+                break
+            batch.append(key)
+            chars += size
+        return batch
+
+    async def _drain(self, channel_id):
+        try:
+            attempts = 0
+            while self._channels.get(channel_id):
+                if self.before_send:
+                    await self.before_send()
+                    if not self._channels.get(channel_id):
+                        break  # a reload found this channel already delivered by another worker
+                batch = self._next_batch(channel_id)
+                if not batch:
+                    break
+                items = [self._records[key]["item"] for key in batch]
+                if self.wait_for_slot:
+                    await self.wait_for_slot(channel_id)
+                try:
+                    with self.span("announcement_send", channel=channel_id, items=len(batch)):
+                        await self.send(channel_id, items)
+                except Exception as e:
+                    attempts += 1
+                    if self.is_permanent(e) or attempts >= self.max_attempts:
+                        print(f"Dropping {len(batch)} announcement(s) for channel {channel_id} after {attempts} attempt(s): {e}")
+                        self.dropped += len(batch)
+                        self._ack(channel_id, batch)
+                        attempts = 0
+                    else:
+                        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+                        print(f"Error sending announcements to channel {channel_id}, retrying in {delay:.0f}s: {e}")
+                        self.retries += 1
+                        await asyncio.sleep(delay)
+                    continue
+                attempts = 0
+                self.messages += 1
+                self.sent += len(batch)
+                self._ack(channel_id, batch)
+        finally:
+            del self._workers[channel_id]
+            if not self._workers:
+                self._idle.set()
+
+    def _ack(self, channel_id, keys):
+        """Record that `keys` are done for this channel, in one write"""
+        done, remaining = [], {}
+        pending = self._channels.get(channel_id, {})
+        for key in keys:
+            pending.pop(key, None)
+            record = self._records.get(key)
+            if record is None:
+                continue
+            record["channels"] = [other for other in record["channels"] if other != channel_id]
+            if record["channels"]:
+                remaining[key] = record
+            else:
+                done.append(key)
+        if not pending:
+            self._channels.pop(channel_id, None)
+        if remaining:
+            self.store.upsert_many(self.namespace, remaining)
+        if done:
+            self.store.delete_many(self.namespace, done)
+        for key in done:
+            record = self._records.pop(key)
+            self.on_delivered(record["source"], record["item"]["id"])
@@ -1,139 +1,293 @@
 import os
 import json
-import re
 import time
-import threading
-from datetime import datetime, timedelta
+import signal
+import socket
+from datetime import datetime
 import asyncio
-from bs4 import BeautifulSoup
+import aiohttp
+from aiohttp import web
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 import google.generativeai as genai
-from flask import Flask
-import requests
+from client_profiles import client_options
+from generation import GenerationPool, GenerationBusy, GenerationExpired, FakeModel, ResponseCache
+from storage import WriteBehind, Lease, Ownership, open_store
+from memory import ConversationStore, Turn
+from scheduler import ReminderScheduler, ReminderIndex
+from ratelimit import TokenBucket, KeyedRateLimiter
+from listings import Source, WatcherEngine, SeenStore, AnnouncementQueue
+from routing import ClusterRouter
+from prompt import ContextBuilder
+from recall import RecallIndex
+from admission import AdmissionController
+from triggers import TriggerMatcher
+from timeutils import Schedule, parse_duration, parse_schedule, format_duration, now_epoch, iso_to_epoch
+from metrics import Registry, LoopLagMonitor
 
 # ==== ENVIRONMENT VARIABLES ====
 DISCORD_BOT_TOKEN = os.environ.get("DISCORD_BOT_TOKEN")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 PORT = int(os.environ.get("PORT", 10000))
 PING_URL = os.environ.get("PING_URL")
+PING_INTERVAL = 600  # every 10 minutes
 CHANNEL_ID = 1379454589094596718
-ANNOUNCEMENTS_URL = "https://www.kucoin.com/announcement/new-listings"
-CHECK_INTERVAL = 600  # 10 minutes in seconds
+ANNOUNCEMENTS_URL = os.environ.get("ANNOUNCEMENTS_URL", "https://www.kucoin.com/announcement/new-listings")
+CHECK_INTERVAL = 600  # slowest poll interval for a quiet listings source, in seconds
+LISTINGS_MIN_INTERVAL = int(os.environ.get("LISTINGS_MIN_INTERVAL", 60))  # fastest, right after a new listing
+# Optional JSON list of listings sources, each like
+# {"name": "kucoin", "url": "...", "channels": [123, 456], "parser": "kucoin", "min_interval": 60, "max_interval": 600}
+WATCH_SOURCES = os.environ.get("WATCH_SOURCES")
 SEEN_FILE = "kucoin_seen.json"
-# ==== FLASK SELF-PING SERVER ====
-app = Flask(__name__)
+# Sharding: SHARD_COUNT enables AutoShardedBot; SHARD_IDS (e.g. "0,2") limits this
+# process to some of the shards, which is how cluster.py runs several workers
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None
+SHARD_IDS = [int(shard) for shard in os.environ["SHARD_IDS"].split(",")] if os.environ.get("SHARD_IDS") else None
+CLUSTERED = SHARD_IDS is not None
+WORKER_ID = os.environ.get("WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+# Workers hand chats to the worker that owns the user's memory through each other's web servers;
+# cluster.py sets a shared CLUSTER_SECRET, without one every worker answers its own messages
+CLUSTER_SECRET = os.environ.get("CLUSTER_SECRET")
+WORKER_URL = os.environ.get("WORKER_URL", f"http://127.0.0.1:{PORT}")
+# "minimal" (default) or "full"; see client_profiles.py
+INTENTS_PROFILE = os.environ.get("INTENTS_PROFILE", "minimal")
+MESSAGE_CACHE_SIZE = int(os.environ.get("MESSAGE_CACHE_SIZE", 100))
+# ==== DISCORD BOT SETUP ====
+bot_options = client_options(INTENTS_PROFILE, MESSAGE_CACHE_SIZE)
+if SHARD_COUNT or os.environ.get("AUTO_SHARD") == "1":
+    bot = commands.AutoShardedBot(command_prefix='!', shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **bot_options)
+else:
+    bot = commands.Bot(command_prefix='!', **bot_options)
+background_tasks = set()
+draining_tasks = set()  # work that shutdown lets finish (reminder sends) instead of cancelling
 
-@app.route("/")
-def home():
-    return "Nikki bot is alive!"
+def spawn(coro, drain=False):
+    """Run a coroutine in the background, keeping a reference so it isn't garbage collected"""
+    task = bot.loop.create_task(coro)
+    tasks_set = draining_tasks if drain else background_tasks
+    tasks_set.add(task)
+    task.add_done_callback(tasks_set.discard)
+    return task
 
-def ping_self():
-    while True:
-        try:
-            if PING_URL:
-                requests.get(PING_URL, timeout=10)
-        except Exception as e:
-            print(f"Self-ping failed: {e}")
-        time.sleep(600)  # every 10 minutes
+# Stay under Discord's buckets ourselves instead of bouncing off 429s:
+# roughly 5 messages / 5s per channel and 50 requests/s globally
+channel_send_limiter = KeyedRateLimiter(5, 5)
+global_send_limiter = TokenBucket(50, 1)
 
-# ==== DISCORD BOT SETUP ====
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix='!', intents=intents)
+async def wait_for_send_slot(channel_id):
+    await channel_send_limiter.acquire(channel_id)
+    await global_send_limiter.acquire()
+
+# ==== INSTRUMENTATION ====
+SLOW_SPAN = float(os.environ.get("SLOW_SPAN", 5))  # log pipeline stages slower than this (seconds)
+LOOP_LAG_THRESHOLD = float(os.environ.get("LOOP_LAG_THRESHOLD", 0.25))  # dump the loop's stack when blocked this long
+
+metrics = Registry(slow_span=SLOW_SPAN)
+loop_lag = LoopLagMonitor(
+    threshold=LOOP_LAG_THRESHOLD,
+    histogram=metrics.histogram("loop_lag_sample_seconds", "Event loop lag per sample",
+                                buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+)
+conversation_outcomes = metrics.count("conversations_total", "Chat requests by outcome", label="outcome")
+reminder_outcomes = metrics.count("reminder_messages_total", "Reminder messages by outcome", label="outcome")
+prompt_tokens = metrics.histogram("prompt_tokens", "Estimated prompt size in tokens",
+                                  buckets=(250, 500, 1000, 1500, 2000, 3000, 4000))
 
 # ==== FILES & STORAGE ====
 MEMORY_FILE = "conversation_memory.json"
 REMINDERS_FILE = "reminders.json"
 AIRDROPS_FILE = "airdrops.json"
+DB_FILE = os.environ.get("DB_FILE", "nikki.db")
+# Verified snapshot of DB_FILE, restored automatically if the database fails its integrity check
+CHECKPOINT_FILE = os.environ.get("CHECKPOINT_FILE", f"{DB_FILE}.checkpoint")
+CHECKPOINT_INTERVAL = int(os.environ.get("CHECKPOINT_INTERVAL", 900))  # seconds
+SHUTDOWN_GRACE = float(os.environ.get("SHUTDOWN_GRACE", 20))  # seconds to let in-flight work finish
+MEMORY_FLUSH_INTERVAL = float(os.environ.get("MEMORY_FLUSH_INTERVAL", 5))  # seconds
+MEMORY_FLUSH_BATCH = int(os.environ.get("MEMORY_FLUSH_BATCH", 200))  # dirty users before an early flush
+MEMORY_MAX_RESIDENT = int(os.environ.get("MEMORY_MAX_RESIDENT", 10000))  # users kept in RAM
+MEMORY_MAX_TURNS = 20
+MEMORY_ARCHIVE_LIMIT = int(os.environ.get("MEMORY_ARCHIVE_LIMIT", 500))  # older turns kept per user for recall
+MEMORY_OWNER_TTL = int(os.environ.get("MEMORY_OWNER_TTL", 300))  # seconds a worker keeps a quiet user's memory
 MAIN_CHANNEL_ID = 1376073097068675183
 
-conversation_memory = {}
 active_reminders = {}
-reminder_id_counter = 0
+reminders_in_flight = set()  # popped from the scheduler and not sent yet; their send saves and re-arms them
 airdrops_data = {}
 airdrop_id_counter = 0
+# Other workers follow reminder changes (sync_reminders_task), so only reminder deletes need tombstones
+store = open_store(DB_FILE, CHECKPOINT_FILE, synced=("reminders",))
+# Conversation memory changes on every message, so it is written behind in batches
+memory_writer = WriteBehind(
+    store, interval=MEMORY_FLUSH_INTERVAL, max_dirty=MEMORY_FLUSH_BATCH,
+    on_flush=lambda records, seconds: metrics.spans.labels("persistence").observe(seconds)
+)
+conversation_memory = ConversationStore(
+    store, memory_writer,
+    max_resident=MEMORY_MAX_RESIDENT,
+    max_turns=MEMORY_MAX_TURNS,
+    on_evict=lambda user_id: on_memory_evicted(user_id),
+    archive_limit=MEMORY_ARCHIVE_LIMIT
+)
+reminder_scheduler = ReminderScheduler()
+reminder_index = ReminderIndex()
+# Reminders and the listings watcher must run exactly once across all worker processes
+scheduler_lease = Lease(store, "scheduler", WORKER_ID, on_acquired=lambda: on_became_leader())
+# A user can chat on several workers (DMs arrive on shard 0, guilds on any shard), so each user's
+# memory is owned by one worker at a time and the others forward their chats to it
+memory_owners = None
+if CLUSTERED and CLUSTER_SECRET:
+    memory_owners = Ownership(store, "memory", WORKER_ID, ttl=MEMORY_OWNER_TTL,
+                              on_claimed=lambda user_id: reload_user_memory(user_id))
+elif CLUSTERED:
+    print("CLUSTER_SECRET is not set: chats won't be routed to the worker that owns the user's memory")
 
 # ==== LOAD/SAVE HELPERS ====
-def load_json(file, default):
-    try:
-        with open(file, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return default
+def save_records(namespace, records, key=None):
+    """Upsert one record (or all of them when key is None); a missing key is deleted"""
+    with metrics.span("persistence", namespace=namespace):
+        if key is None:
+            store.upsert_many(namespace, records)
+        elif key in records:
+            store.upsert(namespace, key, records[key])
+        else:
+            store.delete(namespace, key)
 
-def save_json(file, data):
-    try:
-        with open(file, 'w') as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        print(f"Error saving {file}: {e}")
+def memory_owner(user_id):
+    """The worker that owns the user's memory, or None if it's this one (claiming it if free)"""
+    return memory_owners.claim(user_id) if memory_owners else None
+
+def reload_user_memory(user_id):
+    # Just claimed: another worker may have changed this user's memory since we cached it
+    conversation_memory.refresh(user_id)
+    context_builder.forget(user_id)
+
+def on_memory_evicted(user_id):
+    context_builder.forget(user_id)
+    if memory_owners:
+        memory_owners.release(user_id)
+
+def forget_user(user_id):
+    """Clear a user's history; False if they never chatted"""
+    user_data = conversation_memory.get(user_id)
+    if not user_data:
+        return False
+    conversation_memory.clear_turns(user_id, user_data)
+    context_builder.forget(user_id)
+    save_memory(user_id)
+    return True
 
 def load_memory():
-    global conversation_memory
-    conversation_memory = load_json(MEMORY_FILE, {})
+    # Users are loaded lazily the first time they chat, so only the one-off import happens here.
+    # The counters were seeded before the import, so count the imported users in
+    if store.migrate_json("memory", MEMORY_FILE):
+        conversation_memory.recount()
 
-def save_memory():
-    save_json(MEMORY_FILE, conversation_memory)
+def save_memory(user_id=None):
+    if user_id is None:
+        save_records("memory", conversation_memory.all_records())
+    else:
+        conversation_memory.mark_dirty(user_id)
 
 def load_reminders():
-    global active_reminders, reminder_id_counter
-    data = load_json(REMINDERS_FILE, {'reminders': {}, 'counter': 0})
-    active_reminders = data.get('reminders', {})
-    reminder_id_counter = data.get('counter', 0)
+    global active_reminders
+    store.migrate_json("reminders", REMINDERS_FILE, records_key='reminders', counter_key='counter')
+    loaded = store.load("reminders")
+    # Reloading on a lease change: sends in progress hold the current dicts, so keep those
+    for reminder_id in reminders_in_flight:
+        if reminder_id in loaded and reminder_id in active_reminders:
+            loaded[reminder_id] = active_reminders[reminder_id]
+    active_reminders = loaded
+    upgraded = {reminder_id: reminder for reminder_id, reminder in active_reminders.items() if upgrade_reminder(reminder)}
+    if upgraded:
+        store.upsert_many("reminders", upgraded)
+        print(f"Converted {len(upgraded)} reminder(s) to epoch due times")
+    reminder_index.rebuild(active_reminders)
+    for reminder_id, reminder in list(active_reminders.items()):
+        if reminder_id in reminders_in_flight:
+            continue
+        if not isinstance(reminder.get('due'), int):
+            print(f"Invalid timestamp for reminder {reminder_id}. Removing.")
+            revoke_reminder(reminder_id)
+            continue
+        schedule_reminder(reminder_id, reminder)
 
-def save_reminders():
-    save_json(REMINDERS_FILE, {'reminders': active_reminders, 'counter': reminder_id_counter})
+def save_reminders(reminder_id=None):
+    save_records("reminders", active_reminders, reminder_id)
 
 def load_airdrops():
     global airdrops_data, airdrop_id_counter
-    data = load_json(AIRDROPS_FILE, {'airdrops': {}, 'counter': 0})
-    airdrops_data = data.get('airdrops', {})
-    airdrop_id_counter = data.get('counter', 0)
+    store.migrate_json("airdrops", AIRDROPS_FILE, records_key='airdrops', counter_key='counter')
+    airdrops_data = store.load("airdrops")
+    airdrop_id_counter = store.get_meta("airdrops_counter", 0)
 
-def save_airdrops():
-    save_json(AIRDROPS_FILE, {'airdrops': airdrops_data, 'counter': airdrop_id_counter})
+def save_airdrops(airdrop_id=None):
+    save_records("airdrops", airdrops_data, airdrop_id)
+    store.set_meta("airdrops_counter", airdrop_id_counter)
 
 # ==== TIME HELPERS ====
-def parse_time_to_seconds(time_str):
-    time_str = time_str.lower().strip()
-    matches = re.findall(r'(\d+)([smhd])', time_str)
-    if not matches: return None
-    total = 0
-    for val, unit in matches:
-        val = int(val)
-        if unit == 's': total += val
-        elif unit == 'm': total += val * 60
-        elif unit == 'h': total += val * 3600
-        elif unit == 'd': total += val * 86400
-    return total if total > 0 else None
-
-def format_time(seconds):
-    days = seconds // 86400
-    hours = (seconds % 86400) // 3600
-    minutes = (seconds % 3600) // 60
-    secs = seconds % 60
-    parts = []
-    if days: parts.append(f"{days}d")
-    if hours: parts.append(f"{hours}h")
-    if minutes: parts.append(f"{minutes}m")
-    if secs: parts.append(f"{secs}s")
-    return " ".join(parts) if parts else "0s"
-
-def get_utc_timestamp():
-    """Get current UTC timestamp to avoid timezone issues"""
-    return datetime.utcnow().isoformat()
-
-def parse_utc_timestamp(timestamp_str):
-    """Parse UTC timestamp string back to datetime object"""
-    try:
-        return datetime.fromisoformat(timestamp_str)
-    except (ValueError, TypeError):
-        return None
+# Reminder times are stored as epoch seconds ('due', 'created_at', 'last_sent')
+def upgrade_reminder(reminder):
+    """Convert a reminder saved with ISO timestamps to epoch seconds, in place. True if it changed"""
+    if 'next_reminder' not in reminder:
+        return False
+    reminder['due'] = iso_to_epoch(reminder.pop('next_reminder'))
+    for field in ('created_at', 'last_sent'):
+        if isinstance(reminder.get(field), str):
+            reminder[field] = iso_to_epoch(reminder[field])
+    return True
+
+def next_due(reminder, after=None):
+    """Next time a reminder should fire after `after` (default now): its schedule, or now + interval"""
+    after = now_epoch() if after is None else after
+    if reminder.get('schedule'):
+        return Schedule.from_record(reminder['schedule']).next_after(after)
+    return after + reminder['interval']
+
+def describe_recurrence(reminder):
+    if reminder.get('schedule'):
+        return Schedule.from_record(reminder['schedule']).describe()
+    return f"every {format_duration(reminder['interval'])}"
+
+def schedule_reminder(reminder_id, reminder):
+    """(Re-)arm a reminder in the scheduler from its stored due time"""
+    if isinstance(reminder.get('due'), int):
+        reminder_scheduler.schedule(reminder_id, reminder['due'])
 
 # ==== GEMINI SETUP ====
 genai.configure(api_key=GEMINI_API_KEY)
+GENERATION_WORKERS = int(os.environ.get("GENERATION_WORKERS", 8))
+GENERATION_PER_CHANNEL = int(os.environ.get("GENERATION_PER_CHANNEL", 2))
+GENERATION_MAX_QUEUE = int(os.environ.get("GENERATION_MAX_QUEUE", 64))
+# Stream replies into a message that is edited as tokens arrive (STREAM_REPLIES=1)
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "0") == "1"
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", 1.5))  # seconds between edits
+MESSAGE_LIMIT = 2000
+# Set FAKE_MODEL_LATENCY (seconds) to swap Gemini for a local stand-in when load testing
+FAKE_MODEL_LATENCY = os.environ.get("FAKE_MODEL_LATENCY")
+FAKE_MODEL_JITTER = float(os.environ.get("FAKE_MODEL_JITTER", 0))
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1024))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 120))  # seconds
+
+generation_pool = GenerationPool(
+    max_workers=GENERATION_WORKERS,
+    per_channel=GENERATION_PER_CHANNEL,
+    max_queue=GENERATION_MAX_QUEUE
+)
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+_model = None
+
 def get_model():
+    """The model is stateless between calls, so build it (and its safety settings) once"""
+    global _model
+    if _model is None:
+        _model = create_model()
+    return _model
+
+def create_model():
+    if FAKE_MODEL_LATENCY is not None:
+        return FakeModel(latency=float(FAKE_MODEL_LATENCY), jitter=FAKE_MODEL_JITTER)
     return genai.GenerativeModel(
         model_name="gemini-1.5-flash",
         generation_config={"temperature": 0.9, "top_p": 0.95, "top_k": 40, "max_output_tokens": 1000},
@@ -163,320 +317,680 @@ def clean_response(response):
         response = response.replace(phrase, "")
     return response.strip()
 
+def generate_reply(context):
+    """Blocking Gemini call, run inside the generation pool"""
+    with metrics.span("model"):
+        return get_model().generate_content(context).text
+
+def generate_reply_stream(context):
+    """Blocking streaming Gemini call yielding text chunks, run inside the generation pool"""
+    start = time.perf_counter()
+    first = True
+    with metrics.span("model"):
+        for chunk in get_model().generate_content(context, stream=True):
+            if first:
+                metrics.spans.labels("model_first_chunk").observe(time.perf_counter() - start)
+                first = False
+            yield chunk.text
+
+def find_break(text, limit=MESSAGE_LIMIT):
+    """Index to cut text at so the head fits in `limit`, preferring sentence then word breaks"""
+    window = text[:limit]
+    sentence_end = max(window.rfind(sep) + len(sep) for sep in ("\n", ". ", "! ", "? "))
+    if sentence_end >= limit // 2:
+        return sentence_end
+    space = window.rfind(" ")
+    return space + 1 if space > 0 else limit
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    chunks = []
+    while len(text) > limit:
+        cut = find_break(text, limit)
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    chunks.append(text)
+    return chunks
+
+class StreamingReply:
+    """Shows a reply while it is generated by editing one message, throttled to
+    STREAM_EDIT_INTERVAL, and rolling over to a new message at the 2000-char limit"""
+    def __init__(self, message, edit_interval=STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.channel_id = message.channel.id
+        self.edit_interval = edit_interval
+        self.current = None
+        self.shown = ""
+        self.text = ""
+        self.last_edit = 0.0
+
+    async def feed(self, chunk):
+        self.text += chunk
+        while len(self.text) > MESSAGE_LIMIT:
+            cut = find_break(self.text)
+            head, self.text = self.text[:cut].rstrip(), self.text[cut:].lstrip()
+            await self._show(head, final=True)
+            self.current = None
+            self.shown = ""
+        await self._show(self.text)
+
+    async def finish(self):
+        await self._show(self.text, final=True)
+
+    async def _show(self, text, final=False):
+        text = clean_response(text)
+        if not text or text == self.shown:
+            return
+        if self.current is None:
+            await wait_for_send_slot(self.channel_id)
+            with metrics.span("discord_send"):
+                self.current = await self.message.reply(text)
+        else:
+            if not final:
+                # Intermediate edits are best effort: skip them rather than wait on rate limits
+                if time.monotonic() - self.last_edit < self.edit_interval:
+                    return
+                if not channel_send_limiter.try_acquire(self.channel_id):
+                    return
+            else:
+                await wait_for_send_slot(self.channel_id)
+            with metrics.span("discord_edit"):
+                await self.current.edit(content=text)
+        self.shown = text
+        self.last_edit = time.monotonic()
+
+async def stream_reply(message, context, deadline=None):
+    """Stream a reply into Discord; returns the full raw response text"""
+    reply = StreamingReply(message)
+    parts = []
+    async for chunk in generation_pool.stream(message.channel.id, generate_reply_stream, context, deadline=deadline):
+        parts.append(chunk)
+        await reply.feed(chunk)
+    await reply.finish()
+    return "".join(parts)
+
+PROMPT_HISTORY_BUDGET = int(os.environ.get("PROMPT_HISTORY_BUDGET", 1500))  # tokens of past exchanges
+PROMPT_MESSAGE_BUDGET = int(os.environ.get("PROMPT_MESSAGE_BUDGET", 500))  # tokens of the current message
+PROMPT_RECALL_BUDGET = int(os.environ.get("PROMPT_RECALL_BUDGET", 400))  # tokens of recalled older exchanges
+RECALL_TOP_K = int(os.environ.get("RECALL_TOP_K", 3))
+
+context_builder = ContextBuilder(
+    PERSONALITY_PROMPT,
+    max_turns=10,
+    history_budget=PROMPT_HISTORY_BUDGET,
+    message_budget=PROMPT_MESSAGE_BUDGET,
+    # Relevant exchanges from further back than the recent window, including archived turns
+    recall=RecallIndex(conversation_memory.archived_turns, top_k=RECALL_TOP_K, max_docs=MEMORY_ARCHIVE_LIMIT + MEMORY_MAX_TURNS),
+    recall_budget=PROMPT_RECALL_BUDGET
+)
+
 def build_context(user_id, current_message):
-    user_data = conversation_memory[user_id]
-    username = user_data["username"]
-    context = f"{PERSONALITY_PROMPT}\n\nYou're chatting with {username}. "
-    if user_data["conversations"]:
-        context += "Here's your recent conversation history:\n\n"
-        for conv in user_data["conversations"][-10:]:
-            if conv["response"]:
-                context += f"{username}: {conv['user']}\nNikki: {conv['response']}\n\n"
-    context += f"\nCurrent message from {username}: {current_message}\n\nRespond as Nikki naturally, remembering your previous conversations:"
-    return context
+    """Return (prompt, estimated_tokens) for a user's message"""
+    user_data = conversation_memory.get(user_id)
+    return context_builder.build(user_id, user_data.username, user_data.turns, current_message)
 
 # ==== BULLETPROOF REMINDER SYSTEM ====
-class ReminderView(discord.ui.View):
-    def __init__(self, reminder_id, user_id):
-        super().__init__(timeout=None)
+REMINDER_RETRY_DELAY = 60  # seconds before retrying a reminder that failed to send
+OVERDUE_WORKERS = 4
+OVERDUE_BATCH_SIZE = 5  # one button row per reminder, and Discord allows 5 rows per message
+
+catchup_progress = {'total': 0, 'sent': 0, 'failed': 0, 'running': False}
+
+def complete_reminder(reminder_id):
+    """Re-arm a reminder from now (not the missed time). Returns (reminder, next due epoch) or None"""
+    reminder = active_reminders.get(reminder_id)
+    if not reminder:
+        return None
+    now = now_epoch()
+    reminder['due'] = next_due(reminder, now)
+    reminder['last_sent'] = now
+    save_reminders(reminder_id)
+    schedule_reminder(reminder_id, reminder)
+    return reminder, reminder['due']
+
+def revoke_reminder(reminder_id):
+    """Delete a reminder for good. Returns the removed reminder or None"""
+    reminder = active_reminders.pop(reminder_id, None)
+    if reminder:
+        reminder_scheduler.cancel(reminder_id)
+        reminder_index.remove(reminder_id, reminder)
+        save_reminders(reminder_id)
+    return reminder
+
+class ReminderButton(discord.ui.DynamicItem[discord.ui.Button], template=r"reminder_(?P<action>completed|revoke)(?::(?P<reminder_id>reminder_\d+))?"):
+    """Completed/Revoke button for any reminder message, routed by custom_id.
+
+    Registered once with bot.add_dynamic_items, so clicks keep working across
+    restarts without a persistent view per reminder. Buttons from before the
+    id was part of the custom_id are resolved from the embed footer.
+    """
+    def __init__(self, action, reminder_id, label=None, row=None):
+        if label is None:
+            label = "✅ Completed" if action == "completed" else "🗑️ Revoke"
+        super().__init__(discord.ui.Button(
+            label=label,
+            style=discord.ButtonStyle.success if action == "completed" else discord.ButtonStyle.danger,
+            custom_id=f"reminder_{action}:{reminder_id}",
+            row=row
+        ))
+        self.action = action
         self.reminder_id = reminder_id
-        self.user_id = user_id
 
-    @discord.ui.button(label="✅ Completed", style=discord.ButtonStyle.success, custom_id="reminder_completed")
-    async def completed_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if str(interaction.user.id) != self.user_id:
-            await interaction.response.send_message("Only the person who set this reminder can mark it as completed!", ephemeral=True)
-            return
-        
-        if self.reminder_id in active_reminders:
-            reminder = active_reminders[self.reminder_id]
-            # Calculate next reminder time from current time (not the missed time)
-            next_time = datetime.utcnow() + timedelta(seconds=reminder['interval'])
-            reminder['next_reminder'] = next_time.isoformat()
-            reminder['last_sent'] = get_utc_timestamp()
-            save_reminders()
-            
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        reminder_id = match["reminder_id"]
+        if reminder_id is None and interaction.message and interaction.message.embeds:
+            footer = interaction.message.embeds[0].footer.text or ""
+            reminder_id = footer.replace("Reminder ID:", "").split("|")[0].strip()
+        return cls(match["action"], reminder_id, label=item.label, row=item.row)
+
+    async def callback(self, interaction: discord.Interaction):
+        await handle_reminder_click(interaction, self.action, self.reminder_id)
+
+def reminder_view(reminder_ids):
+    """Buttons for a reminder message: one pair, or one labelled row per reminder in a batch"""
+    view = discord.ui.View(timeout=None)
+    if len(reminder_ids) == 1:
+        view.add_item(ReminderButton("completed", reminder_ids[0]))
+        view.add_item(ReminderButton("revoke", reminder_ids[0]))
+        return view
+    for row, reminder_id in enumerate(reminder_ids):
+        number = reminder_id.split('_')[-1]
+        view.add_item(ReminderButton("completed", reminder_id, label=f"✅ Completed #{number}", row=row))
+        view.add_item(ReminderButton("revoke", reminder_id, label=f"🗑️ Revoke #{number}", row=row))
+    return view
+
+async def handle_reminder_click(interaction, action, reminder_id):
+    reminder = active_reminders.get(reminder_id)
+    if reminder and interaction.user.id != reminder['user_id']:
+        verb = "mark it as completed" if action == "completed" else "revoke it"
+        await interaction.response.send_message(f"Only the person who set this reminder can {verb}!", ephemeral=True)
+        return
+    
+    if len(interaction.message.embeds) > 1:
+        await handle_batch_reminder_click(interaction, action, reminder_id)
+        return
+    
+    if action == "completed":
+        result = complete_reminder(reminder_id)
+        if result:
+            reminder, next_time = result
             await interaction.response.edit_message(
-                content=f"✅ **Reminder completed!** Next reminder: <t:{int(next_time.timestamp())}:R>\n\n📝 **Message:** {reminder['message']}",
-                view=self
+                content=f"✅ **Reminder completed!** Next reminder: <t:{next_time}:R>\n\n📝 **Message:** {reminder['message']}",
+                view=reminder_view([reminder_id])
             )
         else:
             await interaction.response.edit_message(content="❌ This reminder no longer exists.", view=None)
-
-    @discord.ui.button(label="🗑️ Revoke", style=discord.ButtonStyle.danger, custom_id="reminder_revoke")
-    async def revoke_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if str(interaction.user.id) != self.user_id:
-            await interaction.response.send_message("Only the person who set this reminder can revoke it!", ephemeral=True)
-            return
-        
-        if self.reminder_id in active_reminders:
-            reminder_message = active_reminders[self.reminder_id]['message']
-            del active_reminders[self.reminder_id]
-            save_reminders()
+    else:
+        reminder = revoke_reminder(reminder_id)
+        if reminder:
             await interaction.response.edit_message(
-                content=f"🗑️ **Reminder revoked successfully!**\n\n~~📝 **Message:** {reminder_message}~~",
+                content=f"🗑️ **Reminder revoked successfully!**\n\n~~📝 **Message:** {reminder['message']}~~",
                 view=None
             )
         else:
             await interaction.response.edit_message(content="❌ This reminder was already revoked.", view=None)
 
+async def handle_batch_reminder_click(interaction, action, reminder_id):
+    """Clicks on a coalesced message only disable that reminder's row"""
+    if action == "completed":
+        result = complete_reminder(reminder_id)
+        text = (f"✅ **{reminder_id} completed!** Next reminder: <t:{result[1]}:R>"
+                if result else f"❌ {reminder_id} no longer exists.")
+    else:
+        reminder = revoke_reminder(reminder_id)
+        text = f"🗑️ **{reminder_id} revoked!**" if reminder else f"❌ {reminder_id} was already revoked."
+    
+    view = discord.ui.View.from_message(interaction.message, timeout=None)
+    for item in view.children:
+        if getattr(item, "custom_id", "").endswith(f":{reminder_id}"):
+            item.disabled = True
+    await interaction.response.edit_message(view=view)
+    await interaction.followup.send(text, ephemeral=True)
+
+def build_reminder_embed(reminder_id, reminder, is_overdue=False):
+    # Calculate how late the reminder is if overdue
+    overdue_text = ""
+    if is_overdue:
+        missed_seconds = now_epoch() - reminder['due']
+        overdue_text = f"\n⚠️ **This reminder was {format_duration(missed_seconds)} overdue due to bot downtime.**"
+    
+    embed = discord.Embed(
+        title="⏰ Reminder!",
+        description=f"📝 **Message:** {reminder['message']}\n\n⏱️ **Recurring:** {describe_recurrence(reminder)}{overdue_text}",
+        color=0xffaa00 if not is_overdue else 0xff6600,
+        timestamp=datetime.utcnow()
+    )
+    embed.set_footer(text=f"Reminder ID: {reminder_id}")
+    return embed
+
+def advance_reminder(reminder_id, reminder):
+    """Update next due time and last sent timestamp after a successful send"""
+    now = now_epoch()
+    reminder['due'] = next_due(reminder, now)
+    reminder['last_sent'] = now
+    save_reminders(reminder_id)
+    schedule_reminder(reminder_id, reminder)
+
+def retry_reminder_later(reminder_id):
+    # Don't delete reminder on temporary errors, just retry a bit later
+    if reminder_id in active_reminders:
+        reminder_scheduler.schedule(reminder_id, time.time() + REMINDER_RETRY_DELAY)
+
 async def send_reminder(reminder_id, reminder, is_overdue=False):
     """Send a reminder with proper error handling"""
+    return await send_reminder_batch([reminder_id], is_overdue=is_overdue)
+
+async def send_reminder_batch(reminder_ids, is_overdue=False):
+    """Send one message for reminders sharing a channel and user (at most OVERDUE_BATCH_SIZE)"""
+    reminders = [(reminder_id, active_reminders[reminder_id]) for reminder_id in reminder_ids if reminder_id in active_reminders]
+    if not reminders:
+        reminders_in_flight.difference_update(reminder_ids)
+        return False
+    first = reminders[0][1]
+    
     try:
-        channel = bot.get_channel(reminder['channel_id'])
-        user = bot.get_user(reminder['user_id'])
-        
-        if not channel or not user:
-            print(f"Channel or user not found for reminder {reminder_id}. Removing reminder.")
-            if reminder_id in active_reminders:
-                del active_reminders[reminder_id]
-                save_reminders()
-            return False
-        
-        view = ReminderView(reminder_id, str(reminder['user_id']))
-        
-        # Calculate how late the reminder is if overdue
-        overdue_text = ""
-        if is_overdue:
-            missed_time = datetime.utcnow() - parse_utc_timestamp(reminder['next_reminder'])
-            overdue_text = f"\n⚠️ **This reminder was {format_time(int(missed_time.total_seconds()))} overdue due to bot downtime.**"
-        
-        embed = discord.Embed(
-            title="⏰ Reminder!",
-            description=f"📝 **Message:** {reminder['message']}\n\n⏱️ **Recurring every:** {format_time(reminder['interval'])}{overdue_text}",
-            color=0xffaa00 if not is_overdue else 0xff6600,
-            timestamp=datetime.utcnow()
-        )
-        embed.set_footer(text=f"Reminder ID: {reminder_id}")
-        
-        await channel.send(f"{user.mention}", embed=embed, view=view)
+        # A partial channel sends over REST, so the leader can deliver reminders
+        # for guilds that live on another worker's shards
+        channel = bot.get_partial_messageable(first['channel_id'])
+        view = reminder_view([reminder_id for reminder_id, _ in reminders])
+        embeds = [build_reminder_embed(reminder_id, reminder, is_overdue) for reminder_id, reminder in reminders]
         
-        # Update next reminder time and last sent timestamp
-        next_time = datetime.utcnow() + timedelta(seconds=reminder['interval'])
-        reminder['next_reminder'] = next_time.isoformat()
-        reminder['last_sent'] = get_utc_timestamp()
-        save_reminders()
+        await wait_for_send_slot(channel.id)
+        with metrics.span("reminder_send", reminders=len(reminders)):
+            await channel.send(f"<@{first['user_id']}>", embeds=embeds, view=view)
         
+        for reminder_id, reminder in reminders:
+            advance_reminder(reminder_id, reminder)
+        reminder_outcomes.inc("overdue" if is_overdue else "sent")
         return True
         
+    except (discord.NotFound, discord.Forbidden) as e:
+        # Deleted channel, or the bot lost access to it: retrying would fail forever
+        print(f"Can't deliver reminder(s) {', '.join(reminder_ids)} to channel {first['channel_id']} ({e}). Removing.")
+        reminder_outcomes.inc("channel_gone" if isinstance(e, discord.NotFound) else "forbidden")
+        for reminder_id, _ in reminders:
+            revoke_reminder(reminder_id)
+        return False
     except Exception as e:
-        print(f"Error sending reminder {reminder_id}: {e}")
-        # Don't delete reminder on temporary errors, just log
+        print(f"Error sending reminder(s) {', '.join(reminder_ids)}: {e}")
+        reminder_outcomes.inc("retry")
+        for reminder_id, _ in reminders:
+            retry_reminder_later(reminder_id)
         return False
+    finally:
+        reminders_in_flight.difference_update(reminder_ids)
 
-async def process_overdue_reminders():
-    """Process all overdue reminders on bot startup"""
-    current_time = datetime.utcnow()
-    overdue_count = 0
-    
-    for reminder_id, reminder in list(active_reminders.items()):
-        next_reminder_time = parse_utc_timestamp(reminder['next_reminder'])
-        
-        if not next_reminder_time:
-            print(f"Invalid timestamp for reminder {reminder_id}. Removing.")
-            del active_reminders[reminder_id]
+def collect_overdue_reminders():
+    """Take every overdue reminder out of the scheduler, grouped by (channel, user).
+
+    Runs on every lease (re)acquisition; reminders whose send is already in
+    progress are left to it, so nothing is sent twice.
+    """
+    groups = {}
+    for reminder_id in reminder_scheduler.pop_due():
+        reminder = active_reminders.get(reminder_id)
+        if reminder is None or reminder_id in reminders_in_flight:
             continue
-        
-        if current_time >= next_reminder_time:
-            print(f"Processing overdue reminder {reminder_id}")
-            success = await send_reminder(reminder_id, reminder, is_overdue=True)
-            if success:
-                overdue_count += 1
-            # Small delay to avoid rate limits
-            await asyncio.sleep(1)
+        reminders_in_flight.add(reminder_id)
+        groups.setdefault((reminder['channel_id'], reminder['user_id']), []).append(reminder_id)
+    return groups
+
+async def process_overdue_reminders(groups):
+    """Send reminders missed during downtime in the background, coalesced and rate limited"""
+    batches = asyncio.Queue()
+    for reminder_ids in groups.values():
+        for i in range(0, len(reminder_ids), OVERDUE_BATCH_SIZE):
+            batches.put_nowait(reminder_ids[i:i + OVERDUE_BATCH_SIZE])
+    if batches.empty():
+        return
+    
+    total = sum(len(reminder_ids) for reminder_ids in groups.values())
+    catchup_progress.update(total=total, sent=0, failed=0, running=True)
+    print(f"Catching up on {total} overdue reminder(s) in {batches.qsize()} message(s)")
     
-    if overdue_count > 0:
-        print(f"Processed {overdue_count} overdue reminders")
+    async def worker():
+        while not batches.empty():
+            reminder_ids = batches.get_nowait()
+            success = await send_reminder_batch(reminder_ids, is_overdue=True)
+            catchup_progress['sent' if success else 'failed'] += len(reminder_ids)
+    
+    async def report_progress():
+        while True:
+            await asyncio.sleep(10)
+            print(f"Overdue catch-up: {catchup_progress['sent'] + catchup_progress['failed']}/{total} done")
+    
+    reporter = asyncio.create_task(report_progress())
+    try:
+        await asyncio.gather(*(worker() for _ in range(OVERDUE_WORKERS)))
+    finally:
+        reporter.cancel()
+        catchup_progress['running'] = False
+    print(f"Processed {catchup_progress['sent']} overdue reminders ({catchup_progress['failed']} failed)")
 
-@tasks.loop(seconds=30)
+REMINDER_SYNC_INTERVAL = 5  # seconds between polls for reminder changes made by other workers
+
+def on_became_leader():
+    """This process now runs the singleton jobs: re-arm reminders and catch up on overdue ones"""
+    if CLUSTERED:
+        # Another worker may have changed reminders since we loaded them
+        load_reminders()
+    spawn(process_overdue_reminders(collect_overdue_reminders()), drain=True)
+
+async def sync_reminders_task():
+    """Pick up reminders created, completed or revoked by other worker processes"""
+    seq = store.current_seq()
+    while True:
+        await asyncio.sleep(REMINDER_SYNC_INTERVAL)
+        try:
+            changed, deleted, seq = await asyncio.to_thread(store.changed_since, "reminders", seq)
+        except Exception as e:
+            print(f"Error syncing reminders: {e}")
+            continue
+        for reminder_id, reminder in changed.items():
+            upgrade_reminder(reminder)
+            existing = active_reminders.get(reminder_id)
+            if existing is not None:
+                # Update in place: in-flight sends hold a reference to this dict
+                reminder_index.remove(reminder_id, existing)
+                existing.clear()
+                existing.update(reminder)
+                reminder = existing
+            active_reminders[reminder_id] = reminder
+            reminder_index.add(reminder_id, reminder)
+            if scheduler_lease.held:
+                schedule_reminder(reminder_id, reminder)
+        for reminder_id in deleted:
+            reminder = active_reminders.pop(reminder_id, None)
+            if reminder:
+                reminder_index.remove(reminder_id, reminder)
+                reminder_scheduler.cancel(reminder_id)
+
+@tasks.loop()
 async def check_reminders():
-    """Check for due reminders every 30 seconds"""
-    current_time = datetime.utcnow()
+    """Sleep until the next reminder is due, then send everything that is due"""
+    await scheduler_lease.wait_held()
+    await reminder_scheduler.wait_until_due()
+    if not scheduler_lease.held:
+        return
     
-    for reminder_id, reminder in list(active_reminders.items()):
-        next_reminder_time = parse_utc_timestamp(reminder['next_reminder'])
-        
-        if not next_reminder_time:
-            continue
-        
-        if current_time >= next_reminder_time:
-            await send_reminder(reminder_id, reminder, is_overdue=False)
-            # Small delay to avoid rate limits
-            await asyncio.sleep(0.5)
-
-def load_seen():
-    if os.path.exists(SEEN_FILE):
-        with open(SEEN_FILE, "r") as f:
-            return set(json.load(f))
-    return set()
-
-def save_seen(seen_ids):
-    with open(SEEN_FILE, "w") as f:
-        json.dump(list(seen_ids), f)
-
-def parse_announcements(html):
-    soup = BeautifulSoup(html, "html.parser")
-    items = []
-    for li in soup.find_all("li"):
-        a = li.find("a", href=True)
-        if not a:
-            continue
-        url = "https://www.kucoin.com" + a["href"]
-        title_tag = a.find("h3")
-        title = title_tag.get_text(strip=True) if title_tag else "No Title"
-        ps = a.find_all("p")
-        trading_info = ps[0].get_text(strip=True) if len(ps) > 0 else ""
-        date_info = ps[1].get_text(strip=True) if len(ps) > 1 else ""
-        unique_id = a["href"]  # Use the URL path as a unique identifier
-        items.append({
-            "id": unique_id,
-            "title": title,
-            "trading_info": trading_info,
-            "date_info": date_info,
-            "url": url
-        })
-    return items
+    for reminder_id in reminder_scheduler.pop_due():
+        reminder = active_reminders.get(reminder_id)
+        if reminder and reminder_id not in reminders_in_flight:
+            reminders_in_flight.add(reminder_id)
+            spawn(send_reminder(reminder_id, reminder, is_overdue=False), drain=True)
 
-async def send_announcement(channel, item):
-    embed = discord.Embed(
+# ==== LISTINGS WATCHER ====
+def listing_sources():
+    if WATCH_SOURCES:
+        return [Source.from_config(config) for config in json.loads(WATCH_SOURCES)]
+    return [Source("kucoin", ANNOUNCEMENTS_URL, [CHANNEL_ID], min_interval=LISTINGS_MIN_INTERVAL, max_interval=CHECK_INTERVAL)]
+
+def load_seen(source_name):
+    # KuCoin keeps the original namespace so ids seen before sources existed still count
+    seen_ids = SeenStore(store, namespace="seen" if source_name == "kucoin" else f"seen_{source_name}")
+    if source_name == "kucoin":
+        seen_ids.migrate_json(SEEN_FILE)
+    return seen_ids
+
+_http_session = None
+
+def get_http_session():
+    """Shared aiohttp session (one connection pool for every outgoing request)"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300))
+    return _http_session
+
+def announcement_embed(item):
+    return discord.Embed(
         title=item["title"],
         url=item["url"],
         description=f"{item['trading_info']}\n\nDate: {item['date_info']}",
         color=0x1e9fff
     )
-    await channel.send(embed=embed)
-
-async def kucoin_announcements_task():
-    await bot.wait_until_ready()
-    seen_ids = load_seen()
-    channel = bot.get_channel(CHANNEL_ID)
-    if not channel:
-        print(f"Channel with ID {CHANNEL_ID} not found.")
-        return
 
-    while True:
-        try:
-            print("Checking KuCoin new listings...")
-            resp = requests.get(ANNOUNCEMENTS_URL, timeout=15)
-            if resp.status_code != 200:
-                print(f"Failed to fetch page: {resp.status_code}")
-                await asyncio.sleep(CHECK_INTERVAL)
-                continue
-            items = parse_announcements(resp.text)
-            new_items = [item for item in items if item["id"] not in seen_ids]
-            if new_items:
-                print(f"Found {len(new_items)} new listing(s). Sending to Discord.")
-                for item in new_items:
-                    await send_announcement(channel, item)
-                    seen_ids.add(item["id"])
-                save_seen(seen_ids)
-            else:
-                print("No new listings found.")
-        except Exception as e:
-            print(f"Error in announcement task: {e}")
-        await asyncio.sleep(CHECK_INTERVAL)
+async def send_announcements(channel_id, items):
+    """Post up to 10 listings as one message"""
+    await bot.get_partial_messageable(channel_id).send(embeds=[announcement_embed(item) for item in items])
+
+seen_by_source = {}
+seen_lease_term = None
+
+def seen_for(source_name):
+    seen_ids = seen_by_source.get(source_name)
+    if seen_ids is None:
+        seen_ids = seen_by_source[source_name] = load_seen(source_name)
+    return seen_ids
+
+async def wait_for_watch_turn():
+    """Only the lease holder polls and sends; seen ids and the outbox are reloaded whenever this process (re)gains the lease"""
+    global seen_lease_term
+    await scheduler_lease.wait_held()
+    if seen_lease_term != scheduler_lease.term:
+        # Another worker may have posted listings while we weren't the leader
+        seen_lease_term = scheduler_lease.term
+        seen_by_source.clear()
+        announcement_queue.reload()
+
+# Sends are queued durably and an item only counts as seen once every channel has it,
+# so a failure mid-burst neither loses listings nor posts them twice
+announcement_queue = AnnouncementQueue(
+    store,
+    send_announcements,
+    on_delivered=lambda source_name, item_id: seen_for(source_name).add(item_id),
+    wait_for_slot=wait_for_send_slot,
+    before_send=wait_for_watch_turn,
+    is_permanent=lambda error: isinstance(error, (discord.Forbidden, discord.NotFound)),
+    span=metrics.span
+)
+
+async def post_new_listings(source, items):
+    """Queue new items for every channel subscribed to the source; returns how many were new"""
+    seen_ids = seen_for(source.name)
+    new_items = [item for item in items if item["id"] not in seen_ids]
+    queued = announcement_queue.enqueue(source.name, new_items, source.channels)
+    if queued:
+        print(f"Found {queued} new {source.name} listing(s). Sending to {len(source.channels)} channel(s).")
+    return queued
+
+listings_watcher = WatcherEngine(
+    listing_sources(),
+    get_http_session,
+    post_new_listings,
+    before_poll=wait_for_watch_turn,
+    span=metrics.span
+)
 # ==== EVENTS ====
+ADMISSION_DEBOUNCE = float(os.environ.get("ADMISSION_DEBOUNCE", 1.0))  # seconds to wait for more lines
+ADMISSION_MAX_AGE = float(os.environ.get("ADMISSION_MAX_AGE", 30))  # drop requests queued longer than this
+USER_RATE_LIMIT = int(os.environ.get("USER_RATE_LIMIT", 6))  # prompts per minute
+CHANNEL_RATE_LIMIT = int(os.environ.get("CHANNEL_RATE_LIMIT", 20))
+GUILD_RATE_LIMIT = int(os.environ.get("GUILD_RATE_LIMIT", 60))
+# Names and aliases Nikki answers to anywhere, comma separated (whole words, any case)
+TRIGGER_NAMES = os.environ.get("TRIGGER_NAMES", "nikki,nikhita").split(",")
+
+name_trigger = TriggerMatcher(TRIGGER_NAMES)
+
+startup_done = False
+
 @bot.event
 async def on_ready():
+    global startup_done
     print(f'{bot.user} has logged in!')
-    bot.loop.create_task(kucoin_announcements_task())
+    # on_ready fires again after reconnects; everything below only needs to happen once
+    if startup_done:
+        return
+    startup_done = True
+    
     # Load all data
     load_airdrops()
     load_memory()
     load_reminders()
     
-    # Process any overdue reminders from downtime
-    await process_overdue_reminders()
-    
-    # Register persistent views for existing reminders
-    for reminder_id, reminder in active_reminders.items():
-        bot.add_view(ReminderView(reminder_id, str(reminder['user_id'])))
+    # One routed button class serves every reminder message, old and new
+    bot.add_dynamic_items(ReminderButton)
     
-    # Start reminder checking task
+    # Overdue catch-up, reminders and the listings watcher start once this
+    # process holds the scheduler lease (immediately when running alone)
+    spawn(scheduler_lease.run())
+    spawn(listings_watcher.run())
     if not check_reminders.is_running():
         check_reminders.start()
+    if CLUSTERED:
+        spawn(sync_reminders_task())
     
-    # Sync slash commands
-    try:
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} command(s)")
-    except Exception as e:
-        print(f"Failed to sync commands: {e}")
+    # Start the batched conversation memory writer
+    global memory_writer_task
+    if memory_writer_task is None:
+        memory_writer_task = spawn(memory_writer.run())
+    
+    # Sync slash commands (once per cluster, from the worker with shard 0)
+    if SHARD_IDS is None or 0 in SHARD_IDS:
+        try:
+            synced = await bot.tree.sync()
+            print(f"Synced {len(synced)} command(s)")
+        except Exception as e:
+            print(f"Failed to sync commands: {e}")
 
 @bot.event
 async def on_message(message):
-    if message.author == bot.user:
+    # Cheapest checks first: most guild traffic isn't for Nikki and should cost next to nothing.
+    # There are no prefix commands, so messages never go through process_commands.
+    if message.author == bot.user or shutting_down:
         return
-    
-    should_respond = False
-    if message.channel.id == MAIN_CHANNEL_ID:
-        should_respond = True
-    elif (bot.user.mentioned_in(message) or 
-          isinstance(message.channel, discord.DMChannel) or
-          any(name in message.content.lower() for name in ['nikki', 'nikhita'])):
-        should_respond = True
-    
-    if should_respond:
-        await handle_conversation(message)
-    
-    await bot.process_commands(message)
+    if (message.channel.id == MAIN_CHANNEL_ID
+            or name_trigger.matches(message.content)
+            or message.guild is None
+            or bot.user.mentioned_in(message)):
+        admission.submit(message)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    # Reminders for a deleted channel can never be delivered again
+    for reminder_id in list(reminder_index.for_channel(channel.id)):
+        revoke_reminder(reminder_id)
+
+async def dispatch_burst(messages, deadline):
+    """Answer a debounced burst of messages as one prompt, replying to the last one"""
+    content = "\n".join(message.content for message in messages)
+    message = messages[-1]
+    owner = memory_owner(str(message.author.id))
+    if owner is not None:
+        forwarded = await cluster_router.forward(owner, {
+            "kind": "chat",
+            "user_id": str(message.author.id),
+            "channel_id": message.channel.id,
+            "guild_id": message.guild.id if message.guild else None,
+            "message_id": message.id,
+            "content": content,
+            "max_age": deadline - asyncio.get_running_loop().time(),
+        })
+        if forwarded is not None:
+            return
+        print(f"Answering {message.author.id} here instead of on {owner}")
+    await handle_conversation(message, content, deadline)
+
+admission = AdmissionController(
+    dispatch_burst,
+    debounce=ADMISSION_DEBOUNCE,
+    max_age=ADMISSION_MAX_AGE,
+    user_limit=(USER_RATE_LIMIT, 60),
+    channel_limit=(CHANNEL_RATE_LIMIT, 60),
+    guild_limit=(GUILD_RATE_LIMIT, 60),
+    is_saturated=lambda: generation_pool.saturated
+)
 
-async def handle_conversation(message):
+async def handle_conversation(message, content=None, deadline=None):
     user_id = str(message.author.id)
-    user_message = message.content.replace(f'<@{bot.user.id}>', '').strip()
-    
-    if user_id not in conversation_memory:
-        conversation_memory[user_id] = {
-            "username": message.author.display_name,
-            "conversations": [],
-            "user_info": {}
-        }
-    
-    conversation_memory[user_id]["conversations"].append({
-        "timestamp": get_utc_timestamp(),
-        "user": user_message,
-        "response": None
-    })
+    user_message = (message.content if content is None else content).replace(f'<@{bot.user.id}>', '').strip()
     
-    # Keep only last 20 conversations
-    if len(conversation_memory[user_id]["conversations"]) > 20:
-        conversation_memory[user_id]["conversations"] = conversation_memory[user_id]["conversations"][-20:]
-    
-    context = build_context(user_id, user_message)
+    user_data = conversation_memory.get_or_create(user_id, message.author.display_name)
+    # The ring buffer keeps only the last MEMORY_MAX_TURNS conversations
+    turn = Turn(int(time.time()), user_message)
+    conversation_memory.append_turn(user_id, user_data, turn)
     
     try:
-        async with message.channel.typing():
-            model = get_model()
-            response = model.generate_content(context)
-            bot_response = clean_response(response.text)
-            
-            if len(bot_response) > 2000:
-                chunks = [bot_response[i:i+2000] for i in range(0, len(bot_response), 2000)]
-                for chunk in chunks:
-                    await message.reply(chunk)
+        # Small talk is answered from a prompt without the user's context so the reply can be shared
+        cache_key = response_cache.shared_key(user_message, ignore=name_trigger.names)
+        with metrics.span("prompt_build"):
+            if cache_key is None:
+                context, tokens = build_context(user_id, user_message)
             else:
-                await message.reply(bot_response)
-            
-            conversation_memory[user_id]["conversations"][-1]["response"] = bot_response
-            save_memory()
+                context, tokens = context_builder.build_shared(user_message)
+        prompt_tokens.observe(tokens)
+        
+        with metrics.span("conversation", user=user_id, tokens=tokens):
+            async with message.channel.typing():
+                if STREAM_REPLIES and (cache_key is None or response_cache.get(cache_key) is None):
+                    response_text = await stream_reply(message, context, deadline)
+                    if cache_key is not None:
+                        response_cache.put(cache_key, response_text)
+                    bot_response = clean_response(response_text)
+                else:
+                    with metrics.span("generation"):
+                        response_text = await response_cache.get_or_generate(
+                            cache_key, lambda: generation_pool.run(message.channel.id, generate_reply, context, deadline=deadline)
+                        )
+                    bot_response = clean_response(response_text)
+                    for chunk in split_message(bot_response):
+                        with metrics.span("discord_send"):
+                            await message.reply(chunk)
+                
+                turn.response = bot_response
+                context_builder.record(user_id, user_data.username, user_message, bot_response)
+                save_memory(user_id)
+        conversation_outcomes.inc("replied")
             
+    except GenerationExpired as e:
+        conversation_outcomes.inc("expired")
+        print(f"Dropped stale message from {user_id}: {e}")
+    except GenerationBusy as e:
+        conversation_outcomes.inc("busy")
+        await message.reply("I'm getting way too many messages rn, give me a sec and try again!")
+        print(f"Generation queue full: {e}")
     except Exception as e:
+        conversation_outcomes.inc("error")
         await message.reply("Ugh, something went wrong on my end 😅 Can you try again?")
         print(f"Conversation error: {e}")
+    finally:
+        # The user can be evicted again once no reply is pending
+        conversation_memory.finish_turn(user_id)
+
+# ==== CLUSTER ROUTING ====
+FORWARD_TIMEOUT = 2.5  # seconds; short enough to answer a slash command locally if the owner is gone
+cluster_router = ClusterRouter(store, WORKER_ID, WORKER_URL, CLUSTER_SECRET, get_http_session, timeout=FORWARD_TIMEOUT)
+
+async def handle_forwarded_chat(data):
+    """Answer a chat another worker received for a user whose memory lives here"""
+    memory_owner(data["user_id"])  # renew (or take back) ownership; never forwarded a second time
+    channel = bot.get_partial_messageable(data["channel_id"], guild_id=data["guild_id"])
+    try:
+        message = await channel.fetch_message(data["message_id"])
+    except discord.HTTPException as e:
+        print(f"Could not fetch forwarded message {data['message_id']}: {e}")
+        return
+    await handle_conversation(message, data["content"], asyncio.get_running_loop().time() + data["max_age"])
+
+async def handle_forwarded(data):
+    if data["kind"] == "forget":
+        memory_owner(data["user_id"])
+        return {"forgotten": forget_user(data["user_id"])}
+    spawn(handle_forwarded_chat(data), drain=True)
+    return {"accepted": True}
 
 # ==== SLASH COMMANDS ====
 @bot.tree.command(name="remind", description="Set a recurring reminder")
 @app_commands.describe(
-    time_period="Time period to recur (e.g., '1h30m', '45s', '2d', '30m')",
+    time_period="How often: '1h30m', '45s', '2w 3d', or a schedule like 'every weekday 9am' (UTC, or add utc+2)",
     message="The message to remind you with"
 )
 async def remind_slash(interaction: discord.Interaction, time_period: str, message: str):
-    global reminder_id_counter
-    
-    interval_seconds = parse_time_to_seconds(time_period)
-    if interval_seconds is None or interval_seconds < 30:
+    interval_seconds = parse_duration(time_period)
+    schedule = None if interval_seconds else parse_schedule(time_period)
+    if schedule is None and (interval_seconds is None or interval_seconds < 30):
         await interaction.response.send_message(
-            "❌ **Invalid time format or too short!** Use formats like `30s`, `5m`, `1h30m`, `2d` (min 30s).",
+            "❌ **Invalid time format or too short!** Use formats like `30s`, `5m`, `1h30m`, `2w 3d` (min 30s), "
+            "or a schedule like `every weekday 9am`, `mon, wed and fri at 18:30`, `daily 7pm utc+2`.",
             ephemeral=True
         )
         return
@@ -485,24 +999,28 @@ async def remind_slash(interaction: discord.Interaction, time_period: str, messa
         await interaction.response.send_message("❌ **Reminder message is too long!** Maximum 500 characters.", ephemeral=True)
         return
     
-    reminder_id_counter += 1
-    reminder_id = f"reminder_{reminder_id_counter}"
-    next_reminder_time = datetime.utcnow() + timedelta(seconds=interval_seconds)
-    
-    active_reminders[reminder_id] = {
+    # Allocated in the store so worker processes never hand out the same id
+    reminder_id = f"reminder_{store.increment_meta('reminders_counter')}"
+    now = now_epoch()
+    reminder = {
         'user_id': interaction.user.id,
         'channel_id': interaction.channel.id,
         'message': message,
         'interval': interval_seconds,
-        'next_reminder': next_reminder_time.isoformat(),
-        'created_at': get_utc_timestamp(),
+        'created_at': now,
         'last_sent': None
     }
-    save_reminders()
+    if schedule:
+        reminder['schedule'] = schedule.to_record()
+    reminder['due'] = next_due(reminder, now)
+    active_reminders[reminder_id] = reminder
+    save_reminders(reminder_id)
+    reminder_index.add(reminder_id, reminder)
+    reminder_scheduler.schedule(reminder_id, reminder['due'])
     
     embed = discord.Embed(
         title="✅ Reminder Set Successfully!",
-        description=f"📝 **Message:** {message}\n\n⏱️ **Recurring every:** {format_time(interval_seconds)}\n\n🕐 **First reminder:** <t:{int(next_reminder_time.timestamp())}:R>",
+        description=f"📝 **Message:** {message}\n\n⏱️ **Recurring:** {describe_recurrence(reminder)}\n\n🕐 **First reminder:** <t:{reminder['due']}:R>",
         color=0x00ff00,
         timestamp=datetime.utcnow()
     )
@@ -511,7 +1029,10 @@ async def remind_slash(interaction: discord.Interaction, time_period: str, messa
 
 @bot.tree.command(name="reminders", description="List all your active reminders")
 async def reminders_slash(interaction: discord.Interaction):
-    user_reminders = {k: v for k, v in active_reminders.items() if v['user_id'] == interaction.user.id}
+    user_reminders = {
+        reminder_id: active_reminders[reminder_id]
+        for reminder_id in sorted(reminder_index.for_user(interaction.user.id), key=lambda rid: int(rid.split('_')[-1]))
+    }
     
     if not user_reminders:
         await interaction.response.send_message("📭 **You have no active reminders!**", ephemeral=True)
@@ -524,13 +1045,12 @@ async def reminders_slash(interaction: discord.Interaction):
     )
     
     for reminder_id, reminder in user_reminders.items():
-        next_time = parse_utc_timestamp(reminder['next_reminder'])
-        if next_time:
+        if reminder.get('due'):
             embed.add_field(
                 name=f"🔔 {reminder_id}",
                 value=f"**Message:** {reminder['message'][:100]}{'...' if len(reminder['message']) > 100 else ''}\n"
-                      f"**Interval:** {format_time(reminder['interval'])}\n"
-                      f"**Next:** <t:{int(next_time.timestamp())}:R>",
+                      f"**Recurring:** {describe_recurrence(reminder)}\n"
+                      f"**Next:** <t:{reminder['due']}:R>",
                 inline=False
             )
     
@@ -540,9 +1060,10 @@ async def reminders_slash(interaction: discord.Interaction):
 @bot.tree.command(name="forget", description="Clear your conversation history with Nikki")
 async def forget_slash(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    if user_id in conversation_memory:
-        conversation_memory[user_id]["conversations"] = []
-        save_memory()
+    owner = memory_owner(user_id)
+    reply = await cluster_router.forward(owner, {"kind": "forget", "user_id": user_id}) if owner else None
+    forgotten = reply["forgotten"] if reply is not None else forget_user(user_id)
+    if forgotten:
         await interaction.response.send_message("Okay, I've cleared our chat history! Starting fresh 😊", ephemeral=True)
     else:
         await interaction.response.send_message("We haven't chatted before, so there's nothing to forget!", ephemeral=True)
@@ -550,8 +1071,10 @@ async def forget_slash(interaction: discord.Interaction):
 @bot.tree.command(name="memory", description="Check how many messages you've exchanged with Nikki")
 async def memory_slash(interaction: discord.Interaction):
     user_id = str(interaction.user.id)
-    if user_id in conversation_memory:
-        count = len(conversation_memory[user_id]["conversations"])
+    # Another worker's copy may be a few seconds ahead of disk, which is fine for a count
+    user_data = conversation_memory.get(user_id) if memory_owner(user_id) is None else conversation_memory.peek(user_id)
+    if user_data:
+        count = len(user_data.turns)
         await interaction.response.send_message(f"We've had {count} messages in our conversation! 💭", ephemeral=True)
     else:
         await interaction.response.send_message("We haven't started chatting yet!", ephemeral=True)
@@ -582,8 +1105,8 @@ async def info_slash(interaction: discord.Interaction):
 
 @bot.tree.command(name="stats", description="Get bot statistics")
 async def stats_slash(interaction: discord.Interaction):
-    total_users = len(conversation_memory)
-    total_conversations = sum(len(user_data["conversations"]) for user_data in conversation_memory.values())
+    total_users = conversation_memory.user_count
+    total_conversations = conversation_memory.turn_count
     total_reminders = len(active_reminders)
     
     embed = discord.Embed(
@@ -597,13 +1120,215 @@ async def stats_slash(interaction: discord.Interaction):
     
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
+# ==== HEALTH & METRICS SERVER ====
+# Served from the bot's own event loop, so there is no second HTTP stack or thread
+metrics.collect("gateway_latency_seconds", "Discord gateway heartbeat latency", lambda: bot.latency)
+metrics.collect("loop_lag_seconds", "Worst event loop lag since the last scrape", loop_lag.take_max)
+metrics.counter("loop_stalls_total", "Times the event loop was blocked past LOOP_LAG_THRESHOLD", lambda: loop_lag.stalls)
+metrics.collect("guilds", "Guilds this process is connected to", lambda: len(bot.guilds))
+metrics.collect("admission_pending", "Chat bursts waiting out the debounce window", lambda: admission.pending)
+metrics.counter("admission_messages_total", "Chat messages by admission outcome", lambda: admission.stats, label="outcome")
+metrics.collect("generation_pending", "Model requests queued or running", lambda: generation_pool.pending)
+metrics.collect("generation_running", "Model requests running", lambda: generation_pool.running)
+metrics.counter("generation_completed_total", "Model requests completed", lambda: generation_pool.completed)
+metrics.counter("generation_rejected_total", "Model requests rejected as busy", lambda: generation_pool.rejected)
+metrics.counter("generation_expired_total", "Model requests dropped as stale", lambda: generation_pool.expired)
+metrics.counter("response_cache_hits_total", "Response cache hits", lambda: response_cache.hits)
+metrics.counter("response_cache_misses_total", "Response cache misses", lambda: response_cache.misses)
+metrics.counter("response_cache_coalesced_total", "Small talk requests that shared an in-flight call",
+                lambda: response_cache.coalesced)
+metrics.counter("response_cache_uncacheable_total", "Requests with user-specific prompts (never cached)",
+                lambda: response_cache.uncacheable)
+metrics.collect("memory_dirty_users", "Users with unflushed conversation memory", lambda: memory_writer.pending)
+metrics.collect("memory_resident_users", "Users whose memory is loaded in RAM", lambda: conversation_memory.resident)
+metrics.counter("memory_flushes_total", "Write-behind flushes", lambda: memory_writer.flushes)
+metrics.counter("store_writes_total", "Records written to the store", lambda: store.writes)
+metrics.collect("reminders_scheduled", "Reminders armed in the scheduler", lambda: len(reminder_scheduler))
+metrics.collect("listings_poll_interval_seconds", "Current adaptive poll interval per listings source",
+                lambda: {source.name: source.interval for source in listings_watcher.sources}, label="source")
+metrics.counter("listings_new_items_total", "New listings found per source",
+                lambda: {source.name: source.new_items for source in listings_watcher.sources}, label="source")
+metrics.collect("announcements_pending", "Announcement deliveries waiting in the outbox", lambda: announcement_queue.pending)
+metrics.counter("announcements_sent_total", "Announcement deliveries acknowledged by Discord", lambda: announcement_queue.sent)
+metrics.counter("announcement_messages_total", "Messages used to deliver announcements", lambda: announcement_queue.messages)
+metrics.counter("announcement_retries_total", "Failed announcement sends that were retried", lambda: announcement_queue.retries)
+metrics.counter("announcements_dropped_total", "Announcement deliveries given up on", lambda: announcement_queue.dropped)
+metrics.collect("scheduler_leader", "1 if this process holds the scheduler lease", lambda: scheduler_lease.held)
+metrics.counter("cluster_forwarded_total", "Chats and commands handed to the worker owning the user",
+                lambda: cluster_router.forwarded)
+metrics.counter("cluster_forward_failures_total", "Forwards that failed and were handled here instead",
+                lambda: cluster_router.failed)
+metrics.collect("checkpoint_age_seconds", "Seconds since the last database checkpoint",
+                lambda: time.time() - last_checkpoint if last_checkpoint else None)
+
+async def home_handler(request):
+    return web.Response(text="Nikki bot is alive!")
+
+async def health_handler(request):
+    latency = bot.latency
+    return web.json_response({
+        "status": "ok" if bot.is_ready() else "starting",
+        "worker": WORKER_ID,
+        "gateway_latency_ms": None if latency != latency else round(latency * 1000, 1),  # NaN until connected
+        "loop_lag_ms": round(loop_lag.last * 1000, 1),
+        "loop_lag_max_ms": round(loop_lag.max * 1000, 1),
+        "loop_stalls": loop_lag.stalls,
+        "last_stall_ms": loop_lag.last_stall["blocked_ms"] if loop_lag.last_stall else None,
+        "scheduler_leader": scheduler_lease.held,
+        "shutting_down": shutting_down,
+        "queues": {
+            "admission": admission.pending,
+            "generation_pending": generation_pool.pending,
+            "generation_running": generation_pool.running,
+            "memory_dirty": memory_writer.pending,
+            "announcements": announcement_queue.pending,
+            "reminders": len(reminder_scheduler),
+        },
+    })
+
+async def metrics_handler(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_web_server():
+    app = web.Application()
+    app.add_routes([
+        web.get("/", home_handler),
+        web.get("/health", health_handler),
+        web.get("/metrics", metrics_handler),
+        cluster_router.route(handle_forwarded, accepting=lambda: not shutting_down),
+    ])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    print(f"Health server listening on port {PORT}")
+    return runner
+
+async def ping_self():
+    """Keep-alive request through the shared session (helps but not sufficient for Render)"""
+    while True:
+        try:
+            async with get_http_session().get(PING_URL, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                await response.read()
+        except Exception as e:
+            print(f"Self-ping failed: {e}")
+        await asyncio.sleep(PING_INTERVAL)
+
+async def setup_hook():
+    # Runs before login, so the port is open while the gateway is still connecting
+    global web_runner
+    web_runner = await start_web_server()
+    if memory_owners:
+        cluster_router.register()
+    spawn(loop_lag.run())
+    spawn(checkpoint_task())
+    if PING_URL:
+        spawn(ping_self())
+
+bot.setup_hook = setup_hook
+
+# ==== LIFECYCLE ====
+shutting_down = False
+memory_writer_task = None
+web_runner = None
+last_checkpoint = None
+
+async def checkpoint_store():
+    """Snapshot the database to CHECKPOINT_FILE (off the event loop)"""
+    global last_checkpoint
+    with metrics.span("checkpoint"):
+        await asyncio.to_thread(store.checkpoint, CHECKPOINT_FILE)
+    last_checkpoint = time.time()
+
+async def checkpoint_task():
+    """Prune old tombstones and refresh the checkpoint periodically; in a cluster only the lease holder does it"""
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVAL)
+        if CLUSTERED and not scheduler_lease.held:
+            continue
+        try:
+            await asyncio.to_thread(store.prune_tombstones)
+            await asyncio.to_thread(store.prune_leases)
+            await checkpoint_store()
+        except Exception as e:
+            print(f"Error writing checkpoint: {e}")
+
+async def shutdown():
+    """Stop taking new work, let in-flight work finish, persist everything, then disconnect"""
+    global shutting_down
+    if shutting_down:
+        return
+    shutting_down = True
+    deadline = asyncio.get_running_loop().time() + SHUTDOWN_GRACE
+    print(f"Shutting down: draining in-flight work (up to {SHUTDOWN_GRACE:.0f}s)")
+
+    # No new reminders, polls or syncs; the memory writer keeps running until the final flush
+    check_reminders.cancel()
+    services = [task for task in background_tasks if task is not memory_writer_task]
+    for task in services:
+        task.cancel()
+    await asyncio.gather(*services, return_exceptions=True)
+
+    # Answer the chats already admitted, finish the reminder sends already started
+    # and deliver queued announcements (whatever is left stays in the outbox for next time)
+    try:
+        await asyncio.wait_for(admission.drain(), max(0, deadline - asyncio.get_running_loop().time()))
+    except asyncio.TimeoutError:
+        print("Gave up waiting for in-flight conversations")
+    if scheduler_lease.held:
+        try:
+            await asyncio.wait_for(announcement_queue.join(), max(0, deadline - asyncio.get_running_loop().time()))
+        except asyncio.TimeoutError:
+            print(f"Left {announcement_queue.pending} announcement(s) in the outbox")
+    if draining_tasks:
+        _, unfinished = await asyncio.wait(draining_tasks, timeout=max(0, deadline - asyncio.get_running_loop().time()))
+        for task in unfinished:
+            task.cancel()
+        if unfinished:
+            print(f"Cancelled {len(unfinished)} unfinished reminder send(s)")
+    generation_pool.shutdown(wait=False)
+
+    # The flush waits for any flush the writer task has in progress, so nothing is written twice or out of order
+    try:
+        await memory_writer.flush()
+    except Exception as e:
+        print(f"Error flushing conversation memory: {e}")
+    if memory_writer_task:
+        memory_writer_task.cancel()
+    if not CLUSTERED or scheduler_lease.held:
+        try:
+            await checkpoint_store()
+        except Exception as e:
+            print(f"Error writing checkpoint: {e}")
+    scheduler_lease.release()
+
+    if _http_session is not None:
+        await _http_session.close()
+    if web_runner is not None:
+        await web_runner.cleanup()
+    await bot.close()
+    print("Shutdown complete")
+
+async def run_bot():
+    """Run until the bot stops or SIGINT/SIGTERM arrives, then shut down cleanly"""
+    discord.utils.setup_logging()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with bot:
+        bot_task = asyncio.create_task(bot.start(DISCORD_BOT_TOKEN))
+        stop_task = asyncio.create_task(stop.wait())
+        await asyncio.wait({bot_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        stop_task.cancel()
+        await shutdown()
+        await bot_task  # re-raises login errors
+
 # ==== MAIN ====
 if __name__ == "__main__":
-    # Start Flask server in background
-    threading.Thread(target=lambda: app.run(host="0.0.0.0", port=PORT), daemon=True).start()
-    
-    # Start self-ping in background (helps but not sufficient for Render)
-    threading.Thread(target=ping_self, daemon=True).start()
-    
-    # Run Discord bot
-    bot.run(DISCORD_BOT_TOKEN)
+    try:
+        asyncio.run(run_bot())
+    finally:
+        # Last resort if shutdown() never ran or failed part-way; both are no-ops otherwise
+        memory_writer.flush_sync()
+        scheduler_lease.release()
+        store.close()
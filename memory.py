@@ -0,0 +1,225 @@
+import sys
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+
+class Turn:
+    """One exchange: epoch-second timestamp, the user's message and Nikki's reply (None until sent)"""
+    __slots__ = ("timestamp", "user", "response")
+
+    def __init__(self, timestamp, user, response=None):
+        self.timestamp = timestamp
+        self.user = user
+        self.response = response
+
+
+def _legacy_epoch(iso_timestamp):
+    try:
+        return int(datetime.fromisoformat(iso_timestamp).replace(tzinfo=timezone.utc).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+class UserMemory:
+    """A user's recent turns in a fixed-size ring buffer, plus how many older turns were archived"""
+    __slots__ = ("username", "turns", "user_info", "archived")
+
+    def __init__(self, username, max_turns, turns=(), user_info=None, archived=0):
+        self.username = sys.intern(username)
+        self.turns = deque(turns, maxlen=max_turns)
+        self.user_info = user_info or {}
+        self.archived = archived
+
+    def to_record(self):
+        record = {"u": self.username, "t": [[t.timestamp, t.user, t.response] for t in self.turns]}
+        if self.user_info:
+            record["i"] = self.user_info
+        if self.archived:
+            record["a"] = self.archived
+        return record
+
+    @classmethod
+    def from_record(cls, record, max_turns):
+        if "conversations" in record:
+            # Pre-compaction layout: list of dicts with ISO timestamps
+            turns = (Turn(_legacy_epoch(c.get("timestamp")), c["user"], c.get("response"))
+                     for c in record["conversations"])
+            return cls(record["username"], max_turns, turns, record.get("user_info"))
+        return cls(record["u"], max_turns, (Turn(*t) for t in record["t"]), record.get("i"), record.get("a", 0))
+
+
+class ConversationStore:
+    """Per-user conversation memory, loaded from the Store on demand.
+
+    Only the `max_resident` most recently active users are kept in RAM;
+    the least recently used ones are dropped once they have no unflushed
+    changes and are reloaded from disk the next time they chat. The object
+    also acts as the record mapping handed to WriteBehind.mark, which
+    serialises users with `store[user_id]`.
+
+    Running totals of users and stored turns are kept as store counters,
+    incremented with each flush (so several processes can share them), and
+    /stats never has to walk every user.
+
+    A user with a turn still waiting for its reply (between `append_turn`
+    and `finish_turn`) is never evicted or refreshed, since the reply
+    lands in the resident copy.
+
+    Turns pushed out of the ring buffer aren't lost: each one is written to
+    `archive_namespace` under "<user id>:<n>", keeping the newest
+    `archive_limit` per user, for the recall index to search.
+    """
+
+    def __init__(self, store, writer, namespace="memory", max_resident=10000, max_turns=20, on_evict=None,
+                 archive_namespace="archive", archive_limit=500):
+        self.store = store
+        self.writer = writer
+        self.namespace = namespace
+        self.archive_namespace = archive_namespace
+        self.archive_limit = archive_limit
+        self.max_resident = max_resident
+        self.max_turns = max_turns
+        self.on_evict = on_evict
+        self._resident = OrderedDict()
+        self._pending = {}  # user id -> turns still waiting for a reply
+        self.loads = 0
+        self.evictions = 0
+        self._users_key = f"{namespace}_users"
+        self._turns_key = f"{namespace}_turns"
+        if store.get_meta(self._users_key) is None:
+            self.recount()
+
+    def recount(self):
+        """Reset the counters from a full count (when they're introduced, or after a bulk import)"""
+        users, turns = self._count_from_disk()
+        self.store.set_meta(self._turns_key, turns)
+        self.store.set_meta(self._users_key, users)
+
+    def _count_from_disk(self):
+        users = turns = 0
+        for _, record in self.store.scan(self.namespace):
+            users += 1
+            turns += len(record["t"] if "t" in record else record["conversations"])
+        return users, turns
+
+    @property
+    def user_count(self):
+        return self.store.get_meta(self._users_key, 0) + self.writer.pending_increment(self._users_key)
+
+    @property
+    def turn_count(self):
+        return self.store.get_meta(self._turns_key, 0) + self.writer.pending_increment(self._turns_key)
+
+    # -- mapping protocol used by WriteBehind --
+    def __contains__(self, user_id):
+        return user_id in self._resident
+
+    def __getitem__(self, user_id):
+        return self._resident[user_id].to_record()
+
+    def get(self, user_id):
+        """Return the user's memory (loading it if needed), or None if they never chatted"""
+        user = self._resident.get(user_id)
+        if user is not None:
+            self._resident.move_to_end(user_id)
+            return user
+        record = self.store.get(self.namespace, user_id)
+        if record is None:
+            return None
+        self.loads += 1
+        user = UserMemory.from_record(record, self.max_turns)
+        self._admit(user_id, user)
+        return user
+
+    def peek(self, user_id):
+        """The user's memory as last flushed to disk, without caching it (for read-only use elsewhere)"""
+        record = self.store.get(self.namespace, user_id)
+        return None if record is None else UserMemory.from_record(record, self.max_turns)
+
+    def refresh(self, user_id):
+        """Drop the resident copy so the next `get` reloads it (another process may have changed it)"""
+        if user_id in self._resident and not self._pinned(user_id):
+            del self._resident[user_id]
+
+    def get_or_create(self, user_id, username):
+        user = self.get(user_id)
+        if user is None:
+            user = UserMemory(username, self.max_turns)
+            self._admit(user_id, user)
+            self.writer.increment_meta(self._users_key, 1)
+        return user
+
+    def append_turn(self, user_id, user, turn):
+        """Add a turn; call `finish_turn` once its reply is in (or has failed)"""
+        if len(user.turns) < user.turns.maxlen:
+            self.writer.increment_meta(self._turns_key, 1)
+        else:
+            self._archive(user_id, user, user.turns[0])
+        user.turns.append(turn)
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        self.mark_dirty(user_id)
+
+    def finish_turn(self, user_id):
+        left = self._pending.get(user_id, 0) - 1
+        if left > 0:
+            self._pending[user_id] = left
+        else:
+            self._pending.pop(user_id, None)
+
+    def _pinned(self, user_id):
+        return user_id in self._pending or self.writer.is_dirty(self.namespace, user_id)
+
+    def clear_turns(self, user_id, user):
+        """Forget everything, archive included"""
+        self.writer.increment_meta(self._turns_key, -len(user.turns))
+        user.turns.clear()
+        # By number rather than from disk, so archived turns that aren't flushed yet go too
+        for n in range(max(0, user.archived - self.archive_limit), user.archived):
+            self.writer.mark(self.archive_namespace, self._archive_key(user_id, n), {})
+        user.archived = 0
+
+    def _archive(self, user_id, user, turn):
+        key = self._archive_key(user_id, user.archived)
+        self.writer.mark(self.archive_namespace, key, {key: [turn.timestamp, turn.user, turn.response]})
+        user.archived += 1
+        if user.archived > self.archive_limit:
+            expired = self._archive_key(user_id, user.archived - self.archive_limit - 1)
+            self.writer.mark(self.archive_namespace, expired, {})
+
+    @staticmethod
+    def _archive_key(user_id, n):
+        return f"{user_id}:{n:08d}"
+
+    def archived_turns(self, user_id):
+        """The user's archived turns from disk, oldest first"""
+        return [Turn(*value) for _, value in self.store.load_prefix(self.archive_namespace, f"{user_id}:")]
+
+    def mark_dirty(self, user_id):
+        # WriteBehind deletes keys missing from the mapping, and a user who isn't resident has
+        # nothing unsaved, so only resident users are marked (/forget empties the record via clear_turns)
+        if user_id in self._resident:
+            self.writer.mark(self.namespace, user_id, self)
+
+    def all_records(self):
+        """Every resident user as a storable record (for full saves and snapshots)"""
+        return {user_id: user.to_record() for user_id, user in self._resident.items()}
+
+    @property
+    def resident(self):
+        return len(self._resident)
+
+    def _admit(self, user_id, user):
+        self._resident[user_id] = user
+        if len(self._resident) > self.max_resident:
+            self._evict()
+
+    def _evict(self):
+        for user_id in list(self._resident):
+            if len(self._resident) <= self.max_resident:
+                break
+            if self._pinned(user_id):
+                continue
+            del self._resident[user_id]
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(user_id)
@@ -0,0 +1,224 @@
+import asyncio
+import bisect
+import math
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    """Monotonic count, optionally split by one label"""
+    __slots__ = ("values",)
+
+    def __init__(self):
+        self.values = {}
+
+    def inc(self, label=None, amount=1):
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def get(self, label=None):
+        return self.values.get(label, 0)
+
+
+class Histogram:
+    """Fixed-bucket histogram of observed values (seconds, usually)"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (None if empty, inf past the last bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class HistogramFamily:
+    """One Histogram per label value, created on first use"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.children = {}
+
+    def labels(self, label):
+        histogram = self.children.get(label)
+        if histogram is None:
+            histogram = self.children[label] = Histogram(self.buckets)
+        return histogram
+
+
+class Registry:
+    """Named metrics rendered in the Prometheus text format.
+
+    Values are read at scrape time from callbacks, so the objects that own
+    the numbers (pools, queues, writers) don't need to know about metrics.
+    A callback may return a number, or a dict of {label value: number} when
+    registered with a `label`.
+
+    Metrics owned by the registry itself (`count`, `histogram`, and the
+    per-stage `span` timings) are updated from the hot paths directly.
+    """
+
+    def __init__(self, prefix="nikki", slow_span=None):
+        self.prefix = prefix
+        self.slow_span = slow_span
+        self._metrics = {}
+        self.spans = self.histogram("span_seconds", "Time spent per pipeline stage", label="span")
+
+    def collect(self, name, help, func, kind="gauge", label=None):
+        self._metrics[f"{self.prefix}_{name}"] = (kind, help, func, label)
+
+    def counter(self, name, help, func, label=None):
+        self.collect(name, help, func, "counter", label)
+
+    def count(self, name, help, label=None):
+        counter = Counter()
+        self.collect(name, help, lambda: counter.values if label else counter.get(), "counter", label)
+        return counter
+
+    def histogram(self, name, help, label=None, buckets=DEFAULT_BUCKETS):
+        if label:
+            family = HistogramFamily(buckets)
+            self.collect(name, help, lambda: family.children, "histogram", label)
+            return family
+        histogram = Histogram(buckets)
+        self.collect(name, help, lambda: {None: histogram}, "histogram")
+        return histogram
+
+    @contextmanager
+    def span(self, name, **fields):
+        """Time a block as pipeline stage `name`; blocks slower than `slow_span` are logged"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.spans.labels(name).observe(elapsed)
+            if self.slow_span is not None and elapsed >= self.slow_span:
+                details = "".join(f" {key}={value}" for key, value in fields.items())
+                print(f"Slow span: span={name} ms={elapsed * 1000:.0f}{details}")
+
+    def render(self):
+        lines = []
+        for name, (kind, help, func, label) in self._metrics.items():
+            try:
+                value = func()
+            except Exception as e:
+                print(f"Error collecting metric {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for key, histogram in value.items():
+                    lines.extend(_histogram_lines(name, label, key, histogram))
+            elif label is None:
+                lines.append(f"{name} {_format(value)}")
+            else:
+                for key, item in value.items():
+                    lines.append(f'{name}{{{label}="{_escape(key)}"}} {_format(item)}')
+        return "\n".join(lines) + "\n"
+
+
+def _format(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(name, label, key, histogram):
+    prefix = f'{label}="{_escape(key)}",' if label else ""
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+    yield f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}'
+    labels = f"{{{prefix[:-1]}}}" if prefix else ""
+    yield f"{name}_sum{labels} {_format(histogram.sum)}"
+    yield f"{name}_count{labels} {histogram.count}"
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a short sleep.
+
+    Anything blocking the loop (sync I/O, heavy parsing, a slow callback)
+    shows up directly as lag. `max` is the worst lag since the last time
+    `take_max` was called, so each scrape sees the spikes in between.
+
+    With a `threshold`, a watchdog thread also notices while the loop is
+    still stuck and logs the loop thread's current stack, which points at
+    the blocking call itself rather than whatever ran after it.
+    """
+
+    def __init__(self, interval=0.5, threshold=None, histogram=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.histogram = histogram
+        self.last = 0.0
+        self.max = 0.0
+        self.samples = 0
+        self.stalls = 0
+        self.last_stall = None
+        self._heartbeat = time.monotonic()
+        self._loop_thread = None
+        self._watchdog = None
+
+    def take_max(self):
+        worst, self.max = self.max, self.last
+        return worst
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        if self.threshold is not None and self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+        while True:
+            start = loop.time()
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - start - self.interval)
+            self.max = max(self.max, self.last)
+            self.samples += 1
+            if self.histogram is not None:
+                self.histogram.observe(self.last)
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(self.threshold / 2)
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or reported == heartbeat:
+                continue
+            # Only report each stall once, while it's happening
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(no frame)"
+            self.stalls += 1
+            self.last_stall = {"at": time.time(), "blocked_ms": round(blocked * 1000), "stack": stack}
+            print(f"Event loop blocked for {blocked * 1000:.0f} ms, loop thread stack:\n{stack}")
@@ -0,0 +1,126 @@
+from collections import deque
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token), good enough for budgeting"""
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "…"
+
+
+class PromptWindow:
+    """Rendered recent exchanges for one user, trimmed from the oldest end.
+
+    Each exchange is rendered once when it is appended and its token
+    estimate is kept next to it, so building a prompt is a join instead of
+    re-formatting the whole history every message.
+    """
+
+    def __init__(self, username, max_turns, budget, turn_cap):
+        self.username = username
+        self.max_turns = max_turns
+        self.budget = budget
+        self.turn_cap = turn_cap
+        self.turns = deque()
+        self.tokens = 0
+
+    def append(self, user_message, response):
+        rendered = (f"{self.username}: {truncate_to_tokens(user_message, self.turn_cap)}\n"
+                    f"Nikki: {truncate_to_tokens(response, self.turn_cap)}\n\n")
+        tokens = estimate_tokens(rendered)
+        self.turns.append((rendered, tokens))
+        self.tokens += tokens
+        while self.turns and (len(self.turns) > self.max_turns or self.tokens > self.budget):
+            _, dropped = self.turns.popleft()
+            self.tokens -= dropped
+
+    def render(self):
+        return "".join(rendered for rendered, _ in self.turns)
+
+
+class ContextBuilder:
+    """Builds Nikki's prompt from per-user rolling windows under a token budget.
+
+    With a `recall` index, older exchanges relevant to the current message
+    (and outside the recent window) are added too, within `recall_budget`.
+    """
+
+    def __init__(self, personality_prompt, max_turns=10, history_budget=1500, message_budget=500, turn_cap=300,
+                 recall=None, recall_budget=400):
+        self.personality_prompt = personality_prompt
+        self.max_turns = max_turns
+        self.history_budget = history_budget
+        self.message_budget = message_budget
+        self.turn_cap = turn_cap
+        self.recall = recall
+        self.recall_budget = recall_budget
+        self._windows = {}
+        self.last_tokens = 0
+
+    def _window(self, user_id, username, conversations):
+        window = self._windows.get(user_id)
+        if window is None or window.username != username:
+            # First prompt for this user since startup (or they renamed): seed from stored history
+            window = PromptWindow(username, self.max_turns, self.history_budget, self.turn_cap)
+            for turn in list(conversations)[-self.max_turns:]:
+                if turn.response:
+                    window.append(turn.user, turn.response)
+            self._windows[user_id] = window
+        return window
+
+    def record(self, user_id, username, user_message, response):
+        """Append a finished exchange to the user's window"""
+        window = self._windows.get(user_id)
+        if window is not None and window.username == username:
+            window.append(user_message, response)
+        if self.recall:
+            self.recall.add(user_id, user_message, response)
+
+    def forget(self, user_id):
+        self._windows.pop(user_id, None)
+        if self.recall:
+            self.recall.forget(user_id)
+
+    def _recalled(self, user_id, username, conversations, current_message, exclude_last):
+        parts = []
+        tokens = 0
+        for user_message, response in self.recall.search(user_id, conversations, current_message, exclude_last):
+            rendered = (f"{username}: {truncate_to_tokens(user_message, self.turn_cap)}\n"
+                        f"Nikki: {truncate_to_tokens(response, self.turn_cap)}\n\n")
+            tokens += estimate_tokens(rendered)
+            if tokens > self.recall_budget:
+                break
+            parts.append(rendered)
+        return "".join(parts)
+
+    def build_shared(self, current_message):
+        """Return (prompt, estimated_tokens) for small talk, with nothing about who sent it"""
+        prompt = (f"{self.personality_prompt}\n\nSomeone in the chat says: "
+                  f"{truncate_to_tokens(current_message, self.message_budget)}\n\n"
+                  "Respond as Nikki naturally, in a way that works whoever said it:")
+        self.last_tokens = estimate_tokens(prompt)
+        return prompt, self.last_tokens
+
+    def build(self, user_id, username, conversations, current_message):
+        """Return (prompt, estimated_tokens)"""
+        window = self._window(user_id, username, conversations)
+        current_message = truncate_to_tokens(current_message, self.message_budget)
+        parts = [f"{self.personality_prompt}\n\nYou're chatting with {username}. "]
+        if self.recall:
+            recalled = self._recalled(user_id, username, conversations, current_message, len(window.turns))
+            if recalled:
+                parts.append("Some older things you two talked about that might be relevant:\n\n")
+                parts.append(recalled)
+        if window.turns:
+            parts.append("Here's your recent conversation history:\n\n")
+            parts.append(window.render())
+        parts.append(f"\nCurrent message from {username}: {current_message}\n\n"
+                     "Respond as Nikki naturally, remembering your previous conversations:")
+        prompt = "".join(parts)
+        self.last_tokens = estimate_tokens(prompt)
+        return prompt, self.last_tokens
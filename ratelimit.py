@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens refill every `per` seconds, up to `rate` banked"""
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.rate, self.tokens + elapsed * self.rate / self.per)
+            self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now; returns False instead of waiting"""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens=1):
+        """Seconds until `tokens` would be available (0 if they already are)"""
+        self._refill(time.monotonic())
+        missing = tokens - self.tokens
+        return 0.0 if missing <= 0 else missing * self.per / self.rate
+
+    async def acquire(self, tokens=1):
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+    @property
+    def idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.rate
+
+
+class KeyedRateLimiter:
+    """One TokenBucket per key (channel, user, guild...), dropping buckets once they refill"""
+
+    def __init__(self, rate, per, max_keys=10000):
+        self.rate = rate
+        self.per = per
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune()
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.per)
+        return bucket
+
+    def try_acquire(self, key, tokens=1):
+        return self.bucket(key).try_acquire(tokens)
+
+    async def acquire(self, key, tokens=1):
+        await self.bucket(key).acquire(tokens)
+
+    def _prune(self):
+        for key in [key for key, bucket in self._buckets.items() if bucket.idle]:
+            del self._buckets[key]
@@ -0,0 +1,109 @@
+import heapq
+import math
+import re
+
+WORD = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset("""
+a an the and or but if so to of in on at for with from about as by is are was were be been being am
+i me my mine you your yours he him his she her it its we us our they them their this that these those
+do does did done have has had not no yes just like what how why when where who which there here
+im i'm it's its dont don't can can't will would should could u ur lol ok okay oh yeah hey hi
+""".split())
+
+
+def tokenize(text):
+    return [word for word in WORD.findall(text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+class UserRecall:
+    """BM25 index over one user's past exchanges, in chronological order"""
+    __slots__ = ("docs", "postings", "total_length")
+
+    def __init__(self):
+        self.docs = []  # (user message, response, length in terms)
+        self.postings = {}  # term -> {doc id: term frequency}
+        self.total_length = 0
+
+    def add(self, user_message, response):
+        terms = tokenize(f"{user_message} {response}")
+        doc_id = len(self.docs)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.docs.append((user_message, response, len(terms)))
+        self.total_length += len(terms)
+
+    def search(self, query_terms, k, exclude_last=0, min_score=1.0, k1=1.2, b=0.75):
+        """Top-k exchanges for the query, oldest first, ignoring the newest `exclude_last`"""
+        searchable = len(self.docs) - exclude_last
+        if searchable <= 0 or not query_terms:
+            return []
+        total = len(self.docs)
+        avg_length = self.total_length / total or 1.0
+        scores = {}
+        for term in set(query_terms):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                if doc_id >= searchable:
+                    continue
+                length = self.docs[doc_id][2]
+                score = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+        best = heapq.nlargest(k, ((score, doc_id) for doc_id, score in scores.items() if score >= min_score))
+        return [self.docs[doc_id][:2] for doc_id in sorted(doc_id for _, doc_id in best)]
+
+
+class RecallIndex:
+    """Keyword recall over everything a user has said, not just the recent window.
+
+    A user's index is built the first time it's needed from their archived
+    turns (`load_archive(user_id)`) plus the turns still in the ring buffer,
+    then appended to as they chat, so no message is ever re-tokenised.
+    Indexes hold at most `max_docs` exchanges; past that the oldest quarter
+    is dropped and the index rebuilt.
+    """
+
+    def __init__(self, load_archive, top_k=3, max_docs=1000, min_score=1.0):
+        self.load_archive = load_archive
+        self.top_k = top_k
+        self.max_docs = max_docs
+        self.min_score = min_score
+        self._users = {}
+        self.builds = 0
+
+    def _index(self, user_id, turns):
+        index = self._users.get(user_id)
+        if index is None:
+            index = self._users[user_id] = UserRecall()
+            for turn in list(self.load_archive(user_id)) + list(turns):
+                if turn.response:
+                    index.add(turn.user, turn.response)
+            self.builds += 1
+        return index
+
+    def add(self, user_id, user_message, response):
+        """Index a finished exchange (only if the user's index is loaded; otherwise it's built later)"""
+        index = self._users.get(user_id)
+        if index is None:
+            return
+        index.add(user_message, response)
+        if len(index.docs) > self.max_docs:
+            rebuilt = UserRecall()
+            for user, reply, _ in index.docs[-(self.max_docs * 3 // 4):]:
+                rebuilt.add(user, reply)
+            self._users[user_id] = rebuilt
+
+    def search(self, user_id, turns, query, exclude_last=0):
+        """Relevant past (user message, response) pairs, skipping the newest `exclude_last`"""
+        query_terms = tokenize(query)
+        if not query_terms:
+            return []
+        return self._index(user_id, turns).search(query_terms, self.top_k, exclude_last, self.min_score)
+
+    def forget(self, user_id):
+        self._users.pop(user_id, None)
@@ -0,0 +1,61 @@
+import aiohttp
+from aiohttp import web
+
+FORWARD_PATH = "/internal/forward"
+
+
+class ClusterRouter:
+    """Hands work to another worker process over the workers' web servers.
+
+    Each worker publishes its base URL in the Store under
+    "worker_url:<worker id>", so any worker can reach the current owner of a
+    key (see storage.Ownership). Requests carry the shared `secret`; a worker
+    started without one neither forwards nor accepts forwarded work.
+    """
+
+    def __init__(self, store, worker_id, url, secret, get_session, timeout=2.5):
+        self.store = store
+        self.worker_id = worker_id
+        self.url = url
+        self.secret = secret
+        self.get_session = get_session
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.forwarded = 0
+        self.failed = 0
+        self.received = 0
+
+    def register(self):
+        self.store.set_meta(f"worker_url:{self.worker_id}", self.url)
+
+    async def forward(self, worker_id, payload):
+        """POST `payload` to the worker; returns its JSON reply, or None if it couldn't be reached"""
+        url = self.store.get_meta(f"worker_url:{worker_id}")
+        if not url or not self.secret:
+            return None
+        try:
+            async with self.get_session().post(
+                url + FORWARD_PATH, json=payload, headers={"X-Cluster-Secret": self.secret}, timeout=self.timeout
+            ) as response:
+                if response.status != 200:
+                    print(f"Worker {worker_id} refused forwarded {payload['kind']}: {response.status}")
+                    self.failed += 1
+                    return None
+                reply = await response.json()
+        except Exception as e:
+            print(f"Could not forward {payload['kind']} to worker {worker_id}: {e}")
+            self.failed += 1
+            return None
+        self.forwarded += 1
+        return reply
+
+    def route(self, handle, accepting=lambda: True):
+        """aiohttp route for FORWARD_PATH; `handle(payload)` is awaited and its result sent back as JSON"""
+        async def handler(request):
+            if not self.secret or request.headers.get("X-Cluster-Secret") != self.secret:
+                return web.Response(status=403)
+            if not accepting():
+                return web.Response(status=503)
+            self.received += 1
+            return web.json_response(await handle(await request.json()))
+
+        return web.post(FORWARD_PATH, handler)
@@ -0,0 +1,114 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class ReminderScheduler:
+    """Min-heap of reminder due times (epoch seconds).
+
+    Rescheduling or cancelling a reminder doesn't search the heap: the live
+    due time is kept in `_due` and heap entries that no longer match it are
+    skipped when they reach the top. The heap is rebuilt once stale entries
+    outnumber live ones so it can't grow without bound.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, reminder_id):
+        return reminder_id in self._due
+
+    def schedule(self, reminder_id, due):
+        """Arm (or re-arm) a reminder to fire at epoch time `due`"""
+        self._due[reminder_id] = due
+        heapq.heappush(self._heap, (due, next(self._seq), reminder_id))
+        if self._heap[0][2] == reminder_id:
+            # New earliest deadline, wake the sleeper so it re-computes its timeout
+            self._wakeup.set()
+        self._maybe_compact()
+
+    def cancel(self, reminder_id):
+        self._due.pop(reminder_id, None)
+        self._maybe_compact()
+
+    def due_time(self, reminder_id):
+        return self._due.get(reminder_id)
+
+    def next_due(self):
+        """Epoch time of the earliest live reminder, or None when nothing is scheduled"""
+        heap = self._heap
+        while heap:
+            due, _, reminder_id = heap[0]
+            if self._due.get(reminder_id) == due:
+                return due
+            heapq.heappop(heap)
+        return None
+
+    def pop_due(self, now=None):
+        """Remove and return the ids of every reminder due at or before `now`"""
+        now = time.time() if now is None else now
+        heap = self._heap
+        due_ids = []
+        while heap and heap[0][0] <= now:
+            due, _, reminder_id = heapq.heappop(heap)
+            if self._due.get(reminder_id) == due:
+                del self._due[reminder_id]
+                due_ids.append(reminder_id)
+        return due_ids
+
+    async def wait_until_due(self):
+        """Sleep until the earliest reminder is due, waking early if it gets re-armed sooner"""
+        while True:
+            self._wakeup.clear()
+            due = self.next_due()
+            timeout = None if due is None else due - time.time()
+            if timeout is not None and timeout <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    def _maybe_compact(self):
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._due):
+            self._heap = [entry for entry in self._heap if self._due.get(entry[2]) == entry[0]]
+            heapq.heapify(self._heap)
+
+
+class ReminderIndex:
+    """Secondary indexes over active reminders (user -> ids, channel -> ids)"""
+
+    def __init__(self):
+        self.by_user = {}
+        self.by_channel = {}
+
+    def add(self, reminder_id, reminder):
+        self.by_user.setdefault(reminder['user_id'], set()).add(reminder_id)
+        self.by_channel.setdefault(reminder['channel_id'], set()).add(reminder_id)
+
+    def remove(self, reminder_id, reminder):
+        for index, key in ((self.by_user, reminder['user_id']), (self.by_channel, reminder['channel_id'])):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(reminder_id)
+                if not ids:
+                    del index[key]
+
+    def rebuild(self, reminders):
+        self.by_user.clear()
+        self.by_channel.clear()
+        for reminder_id, reminder in reminders.items():
+            self.add(reminder_id, reminder)
+
+    def for_user(self, user_id):
+        return self.by_user.get(user_id, set())
+
+    def for_channel(self, channel_id):
+        return self.by_channel.get(channel_id, set())
@@ -0,0 +1,566 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+
+class Store:
+    """SQLite-backed key/value store, one namespace per kind of record.
+
+    Runs in WAL mode so readers never block the writer, and every write is a
+    single transaction, so a crash leaves either the old or the new record
+    on disk, never half of one. Each write bumps a store-wide sequence number
+    stored alongside the row, which lets other processes sharing the
+    database pick up changes since a given point with `changed_since`.
+    Deletes only leave a tombstone in the `synced` namespaces, the ones
+    other processes actually follow, so churn elsewhere (archived turns,
+    seen ids, the outbox) doesn't grow the tombstones table.
+    """
+
+    def __init__(self, path, synced=()):
+        self.path = path
+        self.synced = frozenset(synced)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " seq INTEGER NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_seq ON records (namespace, seq)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tombstones ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, seq INTEGER NOT NULL, deleted_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        if self.synced:
+            placeholders = ",".join("?" * len(self.synced))
+            self._conn.execute(f"DELETE FROM tombstones WHERE namespace NOT IN ({placeholders})", tuple(self.synced))
+        else:
+            self._conn.execute("DELETE FROM tombstones")
+        self.writes = 0
+
+    def _next_seq(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = '_seq'").fetchone()
+        seq = (int(row[0]) if row else 0) + 1
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('_seq', ?)", (str(seq),))
+        return seq
+
+    def load(self, namespace):
+        """Return every record in `namespace` as a dict"""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM records WHERE namespace = ?", (namespace,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM records WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def upsert(self, namespace, key, value):
+        self.upsert_many(namespace, {key: value})
+
+    def upsert_many(self, namespace, records, serialized=False):
+        """Insert or replace several records in one transaction (values already JSON if `serialized`)"""
+        if not records:
+            return
+        if serialized:
+            payload = [(namespace, str(key), value) for key, value in records.items()]
+        else:
+            payload = [(namespace, str(key), json.dumps(value, separators=(",", ":"))) for key, value in records.items()]
+        with self._lock:
+            with self._transaction():
+                seq = self._next_seq()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO records (namespace, key, value, seq) VALUES (?, ?, ?, ?)",
+                    [row + (seq,) for row in payload]
+                )
+                if namespace in self.synced:
+                    self._conn.executemany(
+                        "DELETE FROM tombstones WHERE namespace = ? AND key = ?", [row[:2] for row in payload]
+                    )
+            self.writes += len(payload)
+
+    def delete(self, namespace, key):
+        self.delete_many(namespace, [key])
+
+    def delete_many(self, namespace, keys):
+        if not keys:
+            return
+        with self._lock:
+            with self._transaction():
+                seq = self._next_seq()
+                rows = [(namespace, str(key)) for key in keys]
+                self._conn.executemany("DELETE FROM records WHERE namespace = ? AND key = ?", rows)
+                if namespace in self.synced:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO tombstones (namespace, key, seq, deleted_at) VALUES (?, ?, ?, ?)",
+                        [row + (seq, time.time()) for row in rows]
+                    )
+            self.writes += len(keys)
+
+    def scan(self, namespace, batch_size=500):
+        """Iterate (key, value) over a namespace in batches, without loading it all at once"""
+        last_key = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, value FROM records WHERE namespace = ? AND key > ? ORDER BY key LIMIT ?",
+                    (namespace, last_key, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for key, value in rows:
+                yield key, json.loads(value)
+            last_key = rows[-1][0]
+
+    def load_prefix(self, namespace, prefix):
+        """Return (key, value) pairs whose key starts with `prefix`, in key order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM records WHERE namespace = ? AND key >= ? AND key < ? ORDER BY key",
+                (namespace, prefix, prefix + "\uffff")
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def changed_since(self, namespace, seq):
+        """Return (upserts, deleted_keys, latest_seq) for writes after `seq`, from any process"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, seq FROM records WHERE namespace = ? AND seq > ?", (namespace, seq)
+            ).fetchall()
+            deleted = self._conn.execute(
+                "SELECT key, seq FROM tombstones WHERE namespace = ? AND seq > ?", (namespace, seq)
+            ).fetchall()
+        latest = max([seq] + [row[2] for row in rows] + [row[1] for row in deleted])
+        return {key: json.loads(value) for key, value, _ in rows}, [key for key, _ in deleted], latest
+
+    def current_seq(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = '_seq'").fetchone()
+        return int(row[0]) if row else 0
+
+    def prune_tombstones(self, max_age=86400):
+        """Drop tombstones older than `max_age` seconds (followers poll far more often than that)"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM tombstones WHERE deleted_at < ?", (time.time() - max_age,)).rowcount
+
+    def count(self, namespace):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+            self.writes += 1
+
+    def increment_meta(self, key, delta=1):
+        """Atomically add `delta` to a numeric meta value (safe across processes); returns the new value"""
+        with self._lock:
+            with self._transaction():
+                row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+                value = (json.loads(row[0]) if row else 0) + delta
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self.writes += 1
+        return value
+
+    def acquire_lease(self, name, owner, ttl):
+        """Take or renew the named lease if it is free, expired or already ours"""
+        now = time.time()
+        with self._lock:
+            with self._transaction():
+                row = self._conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+                if row and row[0] != owner and row[1] > now:
+                    return False
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)", (name, owner, now + ttl)
+                )
+        return True
+
+    def release_lease(self, name, owner):
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def lease_owner(self, name):
+        """Current holder of the named lease, or None if it's free or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner FROM leases WHERE name = ? AND expires > ?", (name, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def prune_leases(self):
+        with self._lock:
+            return self._conn.execute("DELETE FROM leases WHERE expires < ?", (time.time(),)).rowcount
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def migrate_json(self, namespace, file, records_key=None, counter_key=None):
+        """Import an old whole-file JSON store into `namespace` once.
+
+        `records_key` picks the dict of records out of the file (e.g. 'reminders'),
+        `counter_key` names an id counter saved as meta '<namespace>_counter'.
+        The JSON file is renamed to '<file>.migrated' afterwards so it isn't
+        imported twice.
+        """
+        if not os.path.exists(file) or self.get_meta(f"migrated:{namespace}"):
+            return False
+        try:
+            with open(file, 'r') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not migrate {file}: {e}")
+            return False
+
+        records = data.get(records_key, {}) if records_key else data
+        self.upsert_many(namespace, records)
+        if counter_key:
+            self.set_meta(f"{namespace}_counter", data.get(counter_key, 0))
+        self.set_meta(f"migrated:{namespace}", True)
+        os.replace(file, file + ".migrated")
+        print(f"Migrated {len(records)} record(s) from {file} into {self.path}")
+        return True
+
+    def checkpoint(self, path):
+        """Write a consistent snapshot of the database to `path`.
+
+        The copy is taken over a separate connection (WAL readers don't block
+        writers), checked with PRAGMA quick_check, fsynced and only then
+        renamed over the previous checkpoint, so `path` always holds the
+        last good snapshot.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        source = sqlite3.connect(self.path)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        problem = verify_database(tmp_path)
+        if problem:
+            os.remove(tmp_path)
+            raise sqlite3.DatabaseError(f"checkpoint failed verification: {problem}")
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_dir(path)
+
+    def close(self):
+        with self._lock:
+            try:
+                # Fold the WAL back into the main file so a cold copy of the .db is complete
+                self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            finally:
+                self._conn.close()
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def verify_database(path):
+    """PRAGMA quick_check a database file: None if it's fine, otherwise what's wrong"""
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return str(e)
+    return None if result == "ok" else result
+
+
+def open_store(path, checkpoint_path=None, synced=()):
+    """Open the Store at `path`, checking it first.
+
+    A database that fails its integrity check is moved aside (never
+    deleted) and replaced with the last good checkpoint; without one the
+    bot starts empty, loudly, with the damaged file kept for recovery.
+    """
+    if os.path.exists(path):
+        problem = verify_database(path)
+        if problem:
+            quarantine = f"{path}.corrupt-{int(time.time())}"
+            print(f"Database {path} failed its integrity check ({problem}); moving it to {quarantine}")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.replace(path + suffix, quarantine + suffix)
+            if checkpoint_path and os.path.exists(checkpoint_path) and not verify_database(checkpoint_path):
+                shutil.copyfile(checkpoint_path, path)
+                print(f"Restored {path} from checkpoint {checkpoint_path}")
+            else:
+                print(f"No usable checkpoint at {checkpoint_path}; starting with an empty database")
+    return Store(path, synced)
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class WriteBehind:
+    """Write-behind buffer in front of a Store.
+
+    Callers `mark` a record dirty instead of writing it. Dirty records are
+    snapshotted on the event loop and written in one transaction per
+    namespace from a worker thread, every `interval` seconds or as soon as
+    `max_dirty` records are pending. A record that changes several times
+    between flushes is written once. `on_flush(records, seconds)` is called
+    after each successful flush.
+    """
+
+    def __init__(self, store, interval=5.0, max_dirty=200, on_flush=None):
+        self.store = store
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.on_flush = on_flush
+        self._dirty = {}
+        self._increments = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.flushes = 0
+        self.records_flushed = 0
+        self.last_flush_size = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    @property
+    def pending(self):
+        return len(self._dirty)
+
+    def mark(self, namespace, key, records):
+        """Note that records[key] changed (or was removed) and must be written"""
+        self._dirty[(namespace, key)] = records
+        if len(self._dirty) >= self.max_dirty:
+            self._wakeup.set()
+
+    def increment_meta(self, key, delta):
+        """Buffer a change to a meta counter, applied atomically with the next flush"""
+        self._increments[key] = self._increments.get(key, 0) + delta
+
+    def pending_increment(self, key):
+        return self._increments.get(key, 0)
+
+    def is_dirty(self, namespace, key):
+        return (namespace, key) in self._dirty
+
+    def _snapshot(self):
+        dirty, self._dirty = self._dirty, {}
+        meta, self._increments = self._increments, {}
+        upserts, deletes = {}, {}
+        for (namespace, key), records in dirty.items():
+            if key in records:
+                upserts.setdefault(namespace, {})[key] = json.dumps(records[key], separators=(",", ":"))
+            else:
+                deletes.setdefault(namespace, []).append(key)
+        return dirty, meta, upserts, deletes
+
+    def _restore(self, dirty, meta):
+        # A failed write must not lose the records; newer marks win over the snapshot
+        for dirty_key, records in dirty.items():
+            self._dirty.setdefault(dirty_key, records)
+        for key, delta in meta.items():
+            self.increment_meta(key, delta)
+
+    def _write(self, meta, upserts, deletes):
+        for namespace, records in upserts.items():
+            self.store.upsert_many(namespace, records, serialized=True)
+        for namespace, keys in deletes.items():
+            self.store.delete_many(namespace, keys)
+        for key, delta in meta.items():
+            self.store.increment_meta(key, delta)
+
+    def _record(self, size, elapsed):
+        self.flushes += 1
+        self.records_flushed += size
+        self.last_flush_size = size
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        if self.on_flush:
+            self.on_flush(size, elapsed)
+
+    async def flush(self):
+        async with self._lock:
+            if not self._dirty and not self._increments:
+                return
+            dirty, meta, upserts, deletes = self._snapshot()
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write, meta, upserts, deletes)
+            except Exception:
+                self._restore(dirty, meta)
+                raise
+            self._record(len(dirty), time.perf_counter() - start)
+
+    def flush_sync(self):
+        """Blocking flush for shutdown, when the event loop is no longer running"""
+        if not self._dirty and not self._increments:
+            return
+        dirty, meta, upserts, deletes = self._snapshot()
+        start = time.perf_counter()
+        try:
+            self._write(meta, upserts, deletes)
+        except Exception:
+            self._restore(dirty, meta)
+            raise
+        self._record(len(dirty), time.perf_counter() - start)
+
+    async def run(self):
+        """Background flush loop"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing pending writes: {e}")
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "flushes": self.flushes,
+            "records_flushed": self.records_flushed,
+            "last_flush_size": self.last_flush_size,
+            "last_flush_ms": self.last_flush_seconds * 1000,
+            "max_flush_ms": self.max_flush_seconds * 1000,
+        }
+
+
+class Lease:
+    """Cluster-wide named lock kept in the Store, so singleton jobs run in exactly one process.
+
+    `run` keeps trying to take the lease and renews it every ttl/3 seconds
+    while held; if the holder dies, another process takes over once the
+    lease expires. `on_acquired` is called every time this process becomes
+    the holder, before waiters are released.
+    """
+
+    def __init__(self, store, name, owner, ttl=30, on_acquired=None):
+        self.store = store
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        self.on_acquired = on_acquired
+        self.held = False
+        self.term = 0
+        self._held_event = asyncio.Event()
+
+    async def wait_held(self):
+        await self._held_event.wait()
+
+    async def run(self):
+        while True:
+            try:
+                held = await asyncio.to_thread(self.store.acquire_lease, self.name, self.owner, self.ttl)
+            except Exception as e:
+                print(f"Error renewing lease {self.name}: {e}")
+                held = False
+            if held and not self.held:
+                self.held = True
+                self.term += 1
+                print(f"{self.owner} now holds the {self.name} lease")
+                try:
+                    if self.on_acquired:
+                        self.on_acquired()
+                except Exception as e:
+                    # Give the lease back and try again next round rather than hold it half set up
+                    print(f"Error taking over lease {self.name}: {e}")
+                    self.held = False
+                    try:
+                        self.store.release_lease(self.name, self.owner)
+                    except Exception as e:
+                        print(f"Error releasing lease {self.name}: {e}")
+                else:
+                    self._held_event.set()
+            elif not held and self.held:
+                self.held = False
+                self._held_event.clear()
+                print(f"{self.owner} lost the {self.name} lease")
+            await asyncio.sleep(self.ttl / 3)
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self._held_event.clear()
+            self.store.release_lease(self.name, self.owner)
+
+
+class Ownership:
+    """Per-key leases in the Store, so each key's cached state lives in one process at a time.
+
+    `claim(key)` returns None when this process owns the key (taking it if
+    it's free or expired), otherwise the id of the process that does. Owned
+    keys are renewed at most every ttl/2 seconds. When a key is claimed
+    afresh, `on_claimed(key)` is called first: another process may have
+    owned it in between, so anything cached for it must be reloaded.
+    """
+
+    def __init__(self, store, prefix, owner, ttl=300, on_claimed=None):
+        self.store = store
+        self.prefix = prefix
+        self.owner = owner
+        self.ttl = ttl
+        self.on_claimed = on_claimed
+        self._expires = {}
+        self.claims = 0
+
+    def claim(self, key):
+        now = time.time()
+        expires = self._expires.get(key, 0)
+        if expires - now > self.ttl / 2:
+            return None
+        name = f"{self.prefix}:{key}"
+        if not self.store.acquire_lease(name, self.owner, self.ttl):
+            self._expires.pop(key, None)
+            return self.store.lease_owner(name)
+        self._expires[key] = now + self.ttl
+        if expires <= now:
+            self.claims += 1
+            if self.on_claimed:
+                self.on_claimed(key)
+        return None
+
+    def release(self, key):
+        if self._expires.pop(key, None) is not None:
+            self.store.release_lease(f"{self.prefix}:{key}", self.owner)
@@ -0,0 +1,161 @@
+import re
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+DAY = 86400
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+UNIT_SECONDS = {"w": 604800, "d": DAY, "h": 3600, "m": 60, "s": 1}
+# One "<number><unit>" piece of a duration; longer unit spellings first so "min" isn't read as "m" + "in"
+DURATION_PART = re.compile(
+    r"\s*(\d+)\s*(weeks?|wks?|w|days?|d|hours?|hrs?|h|minutes?|mins?|m|seconds?|secs?|s)(?![a-z])\s*(?:,|and)?",
+    re.IGNORECASE
+)
+SCHEDULE = re.compile(
+    r"^\s*(?:every\s+)?(?P<days>[a-z,&\s]+?)\s+(?:at\s+)?"
+    r"(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<ampm>am|pm)?"
+    r"(?:\s*utc\s*(?P<tz>[+-]\d{1,2}(?::?\d{2})?)?)?\s*$",
+    re.IGNORECASE
+)
+DAY_SEPARATORS = re.compile(r"\s*(?:,|&|\band\b)\s*|\s+", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def parse_duration(text):
+    """Seconds in a duration like "45s", "1h30m", "2w 3d" or "1 hour and 15 minutes", else None.
+
+    The whole string has to be made of duration parts, so typos are
+    rejected instead of silently ignored.
+    """
+    text = text.strip().lower()
+    if text.startswith("every "):
+        text = text[6:]
+    pos, total = 0, 0
+    while pos < len(text):
+        match = DURATION_PART.match(text, pos)
+        if not match or match.end() == pos:
+            return None
+        total += int(match.group(1)) * UNIT_SECONDS[match.group(2)[0]]
+        pos = match.end()
+    return total or None
+
+
+@lru_cache(maxsize=4096)
+def format_duration(seconds):
+    """Compact duration like "1w 2d 3h 4m 5s" (cached: the same few intervals are shown over and over)"""
+    seconds = int(seconds)
+    parts = []
+    for unit in ("w", "d", "h", "m", "s"):
+        value, seconds = divmod(seconds, UNIT_SECONDS[unit])
+        if value:
+            parts.append(f"{value}{unit}")
+    return " ".join(parts) if parts else "0s"
+
+
+def _parse_days(text):
+    text = text.strip().lower()
+    if text in ("day", "days", "daily"):
+        return tuple(range(7))
+    if text in ("weekday", "weekdays"):
+        return (0, 1, 2, 3, 4)
+    if text in ("weekend", "weekends"):
+        return (5, 6)
+    days = set()
+    for word in DAY_SEPARATORS.split(text):
+        if not word:
+            continue
+        word = word[:-1] if word.endswith("s") and len(word) > 3 else word  # "mondays"
+        matches = [i for i, name in enumerate(WEEKDAYS) if len(word) >= 3 and name.startswith(word)]
+        if len(matches) != 1:
+            return None
+        days.add(matches[0])
+    return tuple(sorted(days)) or None
+
+
+class Schedule:
+    """Calendar recurrence: `hour`:`minute` on the given weekdays (0 = Monday), at a fixed UTC offset"""
+    __slots__ = ("days", "hour", "minute", "offset")
+
+    def __init__(self, days, hour, minute=0, offset=0):
+        self.days = tuple(days)
+        self.hour = hour
+        self.minute = minute
+        self.offset = offset  # minutes east of UTC
+
+    def next_after(self, epoch):
+        """First occurrence strictly after `epoch`, as epoch seconds"""
+        local = int(epoch) + self.offset * 60
+        day_start = local - local % DAY
+        at = self.hour * 3600 + self.minute * 60
+        for i in range(8):
+            candidate = day_start + i * DAY + at
+            weekday = (candidate // DAY + 3) % 7  # 1970-01-01 was a Thursday
+            if candidate > local and weekday in self.days:
+                return candidate - self.offset * 60
+        raise ValueError("schedule has no days")
+
+    def describe(self):
+        if self.days == tuple(range(7)):
+            days = "every day"
+        elif self.days == (0, 1, 2, 3, 4):
+            days = "weekdays"
+        elif self.days == (5, 6):
+            days = "weekends"
+        else:
+            days = ", ".join(WEEKDAYS[day].capitalize() for day in self.days)
+        sign = "+" if self.offset >= 0 else "-"
+        hours, minutes = divmod(abs(self.offset), 60)
+        tz = "UTC" if not self.offset else f"UTC{sign}{hours}" + (f":{minutes:02d}" if minutes else "")
+        return f"{days} at {self.hour:02d}:{self.minute:02d} {tz}"
+
+    def to_record(self):
+        return {"days": list(self.days), "at": [self.hour, self.minute], "offset": self.offset}
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record["days"], *record["at"], offset=record.get("offset", 0))
+
+
+def _parse_offset(text):
+    if not text:
+        return 0
+    sign = -1 if text[0] == "-" else 1
+    digits = text[1:].replace(":", "")
+    hours, minutes = (int(digits[:-2]), int(digits[-2:])) if len(digits) > 2 else (int(digits), 0)
+    if hours > 14 or minutes >= 60:
+        return None
+    return sign * (hours * 60 + minutes)
+
+
+def parse_schedule(text):
+    """Schedule for text like "every weekday 9am", "mon, wed and fri at 18:30" or "daily 7pm utc+2", else None"""
+    match = SCHEDULE.match(text)
+    if not match:
+        return None
+    days = _parse_days(match.group("days"))
+    hour = int(match.group("hour"))
+    minute = int(match.group("minute") or 0)
+    ampm = (match.group("ampm") or "").lower()
+    offset = _parse_offset(match.group("tz"))
+    if days is None or offset is None or minute > 59:
+        return None
+    if ampm:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if ampm == "pm" else 0)
+    elif hour > 23:
+        return None
+    return Schedule(days, hour, minute, offset)
+
+
+def now_epoch():
+    return int(time.time())
+
+
+def iso_to_epoch(value):
+    """Epoch seconds from the naive-UTC ISO strings reminders used to store, or None"""
+    try:
+        return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp())
+    except (TypeError, ValueError):
+        return None
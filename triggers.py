@@ -0,0 +1,25 @@
+import re
+
+
+class TriggerMatcher:
+    """Tells whether a message mentions Nikki by name or alias.
+
+    Names match case-insensitively as whole words ("nikki's" counts,
+    "nikkita" doesn't). Python's regex engine is slow at scanning for an
+    alternation, so the message is first checked with plain substring
+    searches for the names' 3-letter prefixes (one for nikki/nikhita) and
+    the precompiled word-boundary regex only runs on the few that pass.
+    """
+
+    def __init__(self, names):
+        self.names = [name.strip().lower() for name in names if name.strip()]
+        self._prefixes = tuple(sorted({name[:3] for name in self.names}))
+        alternatives = "|".join(re.escape(name) for name in sorted(self.names, key=len, reverse=True))
+        self._search = re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)").search
+
+    def matches(self, content):
+        lowered = content.lower()
+        for prefix in self._prefixes:
+            if prefix in lowered:
+                return self._search(lowered) is not None
+        return False